@@ -0,0 +1,24 @@
+import contextlib
+import os
+import shutil
+
+@contextlib.contextmanager
+def writer(path, mode='w'):
+    """Open a temporary file next to path for writing, and rename it to path once the with block is done, so that nothing ever reads
+    a half-written file. If path already exists, the new file gets its permissions. If the block raises, path is left as it was."""
+    tmp_path = path+'.'+str(os.getpid())+'.tmp'
+    try:
+        with open(tmp_path, mode) as tmp_file:
+            yield tmp_file
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write(path, content):
+    "Write content (a str) to path with writer()."
+    with writer(path) as out_file:
+        out_file.write(content)
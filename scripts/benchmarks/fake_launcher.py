@@ -0,0 +1,118 @@
+#! /usr/bin/python3
+"""Stand-ins for the programs that the CLI runs on a launcher, for benchmarks/simulate.py. They do just enough to look like the real thing
+from the CLI's side, and take about as long:
+
+    fake_launcher.py Generator --workflow-name NAME --workflow-version V --workflow-path P --ini-dir DIR --config PATH
+        Adds a PENDING job to the queue database for each INI in DIR.
+    fake_launcher.py java -cp reporting.jar info.pancancer.arch3.reportcli.ReportCLI --config PATH [REPORT]
+        Prints a report of the job counts in the queue database.
+    fake_launcher.py Coordinator|Provisioner --config PATH --endless
+        Runs until it is sent SIGTERM. While it runs, the Coordinator moves PENDING jobs to RUNNING and the Provisioner moves RUNNING jobs to SUCCESS,
+        so that the job table changes the way it does on a busy launcher. The process shows up as 'java ... Coordinator', like the real one.
+
+The queue database is the SQLite database in PANCANCER_QUEUE_DB. The latencies are read from these environment variables (in seconds):
+
+    PANCANCER_SIM_JVM_STARTUP       how long the JVM takes to start (default: 0.8)
+    PANCANCER_SIM_SECONDS_PER_INI   how long the Generator takes for each INI (default: 0.005)
+    PANCANCER_SIM_DAEMON_STOP       how long a daemon takes to shut down after SIGTERM (default: 0.5)
+    PANCANCER_SIM_DAEMON_TICK       how often a daemon updates jobs (default: 5)
+    PANCANCER_SIM_JOBS_PER_TICK     how many jobs a daemon updates each time (default: 10)
+"""
+import datetime
+import hashlib
+import os
+import signal
+import sqlite3
+import sys
+import time
+import uuid
+
+def setting(name, default):
+    return float(os.environ.get('PANCANCER_SIM_'+name, default))
+
+def connect():
+    # The CLI and the daemons use the database at the same time.
+    connection = sqlite3.connect(os.environ['PANCANCER_QUEUE_DB'], timeout=30)
+    return connection
+
+def now():
+    return datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+
+def option(args, name, default=None):
+    return args[args.index(name)+1] if name in args else default
+
+def generator(args):
+    time.sleep(setting('JVM_STARTUP', 0.8))
+    workflow_name = option(args, '--workflow-name')
+    workflow_version = option(args, '--workflow-version')
+    ini_dir = option(args, '--ini-dir')
+    rows = []
+    for file_name in sorted(os.listdir(ini_dir)):
+        with open(os.path.join(ini_dir, file_name)) as ini_file:
+            ini = ini_file.read()
+        timestamp = now()
+        rows.append(('PENDING', str(uuid.uuid4()), workflow_name, workflow_version, hashlib.md5(ini.encode('utf-8')).hexdigest(), ini, timestamp, timestamp))
+    time.sleep(setting('SECONDS_PER_INI', 0.005) * len(rows))
+    connection = connect()
+    with connection:
+        connection.executemany('insert into job (status, job_uuid, workflow, workflow_version, job_hash, ini, create_timestamp, update_timestamp) values (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.close()
+    print('Generated '+str(len(rows))+' job orders for '+workflow_name)
+    return 0
+
+def report_cli(args):
+    time.sleep(setting('JVM_STARTUP', 0.8))
+    # The report is the argument after the --config path, if there is one.
+    after_config = args[args.index('--config')+2:]
+    report = after_config[0] if after_config else None
+    if report is None:
+        print('usage: ReportCLI --config PATH [gather|info|jobs|provisioned|status|youxia]')
+        return 0
+    connection = connect()
+    rows = connection.execute('select status, count(*) from job group by status order by status').fetchall()
+    connection.close()
+    print(report+':')
+    for status, count in rows:
+        print('  '+status+': '+str(count))
+    return 0
+
+def daemon(service_name, args):
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    time.sleep(setting('JVM_STARTUP', 0.8))
+    # The Coordinator hands pending jobs to workers, and the Provisioner's workers finish them.
+    from_status, to_status = ('PENDING', 'RUNNING') if service_name == 'Coordinator' else ('RUNNING', 'SUCCESS')
+    tick = setting('DAEMON_TICK', 5)
+    jobs_per_tick = int(setting('JOBS_PER_TICK', 10))
+    print(service_name+' started', flush=True)
+    next_tick = time.time()
+    while not stopping:
+        if time.time() >= next_tick:
+            connection = connect()
+            with connection:
+                connection.execute('update job set status = ?, update_timestamp = ? where job_id in (select job_id from job where status = ? order by job_id limit ?)',
+                                   (to_status, now(), from_status, jobs_per_tick))
+            connection.close()
+            next_tick = time.time() + tick
+        time.sleep(0.1)
+    time.sleep(setting('DAEMON_STOP', 0.5))
+    print(service_name+' stopped', flush=True)
+    return 0
+
+def main(argv):
+    program, args = argv[0], argv[1:]
+    if program == 'Generator':
+        return generator(args)
+    if program in ('Coordinator', 'Provisioner'):
+        # Start again as 'java <this script> java -cp arch3.jar ...<service>', so that pgrep and psutil see a java process, as they would on a launcher.
+        os.execv(sys.executable, ['java', os.path.abspath(__file__), 'java', '-cp', 'arch3.jar', 'info.pancancer.arch3.'+program.lower()+'.'+program]+args)
+    if program == 'java':
+        java_class = next(a for a in args if a.startswith('info.pancancer.'))
+        if java_class.endswith('ReportCLI'):
+            return report_cli(args)
+        return daemon(java_class.rsplit('.', 1)[1], args)
+    print('fake_launcher.py does not know how to run '+program, file=sys.stderr)
+    return 127
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,253 @@
+#! /usr/bin/python3
+"""Micro-benchmarks for the CLI's Python hot paths: rendering and deploying the config with process_config.main(), reading a large workflow listing,
+generating INI files with 'workflows config', and updating params.json and the youxia config in the generator.
+
+Everything runs in a temporary home directory, and the workflow listing is served by a local HTTP server, so nothing outside
+of the temporary directory is read or written. The results are compared against hotpaths_baseline.json, and the exit code is 1
+if anything is more than --tolerance times (--disk-tolerance times for the benchmarks that write files) and at least --floor
+milliseconds slower than its baseline.
+
+    python3 benchmarks/hotpaths.py                    # compare against the baseline
+    python3 benchmarks/hotpaths.py --write-baseline   # record the current times as the new baseline
+    python3 benchmarks/hotpaths.py --only listing     # only run the benchmarks whose names contain 'listing'
+"""
+import argparse
+import functools
+import importlib.util
+import http.server
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scripts_dir)
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hotpaths_baseline.json')
+
+def synthetic_listing(num_workflows):
+    "A workflow listing with num_workflows workflows that look like the ones in config/workflowlist.json."
+    with open(os.path.join(scripts_dir, '..', 'config', 'workflowlist.json')) as listing_file:
+        template = json.load(listing_file)['HelloWorld_1.0-SNAPSHOT']
+    listing = {}
+    for i in range(num_workflows):
+        details = json.loads(json.dumps(template))
+        details['full_name'] = 'Workflow_Bundle_Synthetic_'+str(i)+'_SeqWare_1.1.1'
+        details['http_workflow']['version'] = str(i)
+        details['http_workflow']['url'] = 'https://example.com/Workflow_Bundle_Synthetic_'+str(i)+'.zip'
+        listing['Synthetic_'+str(i)] = details
+    return listing
+
+class StubServer:
+    "Serves a directory over HTTP on a free local port, in a background thread."
+    def __init__(self, directory):
+        handler = functools.partial(QuietHandler, directory=directory)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:'+str(self.server.server_address[1])+'/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class Environment:
+    "A temporary home directory (and launcher base directory), with a simple config, a large workflow listing served over HTTP, and the launcher's config files."
+    def __init__(self, num_workflows):
+        self.home = tempfile.mkdtemp(prefix='pancancer_bench_')
+        self.old_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.home
+        # launcher.py reads this when it is first imported, which is after this.
+        os.environ['PANCANCER_BASE_DIR'] = self.home
+        os.environ.setdefault('SENSU_SERVER_IP_ADDRESS', '127.0.0.1')
+        os.environ.setdefault('FLEET_NAME', 'bench')
+        os.environ.setdefault('HOST_ENV', 'AWS')
+        for d in ('.pancancer', 'ini-dir', '.youxia', 'arch3/config', 'www'):
+            os.makedirs(os.path.join(self.home, d))
+        with open(os.path.join(self.home, 'www', 'workflowlist.json'), 'w') as listing_file:
+            json.dump(synthetic_listing(num_workflows), listing_file)
+        self.server = StubServer(os.path.join(self.home, 'www'))
+        self.simple_config_path = os.path.join(self.home, '.pancancer', 'simple_pancancer_config.json')
+        with open(os.path.join(scripts_dir, 'simple_pancancer_config.json')) as simple_config_file:
+            simple_config = json.load(simple_config_file)
+        simple_config['workflow_listing_url'] = self.server.url+'workflowlist.json'
+        with open(self.simple_config_path, 'w') as simple_config_file:
+            json.dump(simple_config, simple_config_file)
+        # process_config.main() writes the rendered files next to process_config.py as well as deploying them, so it is run from a copy.
+        cli_dir = os.path.join(self.home, 'cli')
+        os.makedirs(cli_dir)
+        for name in ('process_config.py', 'pancancer_config.mustache'):
+            shutil.copy(os.path.join(scripts_dir, name), cli_dir)
+        spec = importlib.util.spec_from_file_location('process_config', os.path.join(cli_dir, 'process_config.py'))
+        self.process_config = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.process_config)
+        # Deploy the config files, as sysconfig would have.
+        self.process_config.main(self.simple_config_path)
+
+        import workflowlister
+        workflowlister.WorkflowLister.config_path = self.simple_config_path
+        workflowlister.WorkflowLister.cache_path = os.path.join(self.home, '.pancancer', 'workflow_listing_cache.json')
+        workflowlister.WorkflowLister.catalog_path = os.path.join(self.home, '.pancancer', 'workflow_catalog.json')
+
+    def close(self):
+        self.server.stop()
+        if self.old_home is not None:
+            os.environ['HOME'] = self.old_home
+        shutil.rmtree(self.home, ignore_errors=True)
+
+def bench_config_render(env):
+    "process_config.main() when the config has to be rendered again (as with sysconfig --force): the render, the comparison with the deployed files and the manifest."
+    def run():
+        env.process_config.main(env.simple_config_path, force=True)
+    return run
+
+def bench_config_up_to_date(env):
+    "process_config.main() when nothing has changed, which is what the generator's sysconfig usually does: the input digest and the manifest check."
+    def run():
+        env.process_config.main(env.simple_config_path)
+    return run
+
+def _reset_listing():
+    import workflowlister
+    workflowlister.WorkflowLister._use(None, {}, 0)
+    workflowlister.WorkflowLister._catalog = None
+
+def bench_listing_download(env):
+    "Download and parse the listing from the stub server (--refresh)."
+    import workflowlister
+    def run():
+        _reset_listing()
+        workflowlister.WorkflowLister.refresh = True
+        try:
+            workflowlister.WorkflowLister.read_workflow_details()
+        finally:
+            workflowlister.WorkflowLister.refresh = False
+    return run
+
+def bench_listing_cached(env):
+    "Load the listing from the on-disk cache."
+    import workflowlister
+    workflowlister.WorkflowLister.read_workflow_details()
+    def run():
+        _reset_listing()
+        workflowlister.WorkflowLister.read_workflow_details()
+    return run
+
+def bench_listing_catalog(env):
+    "Build the workflow catalog from a loaded listing and run a filtered lookup."
+    import workflowlister
+    workflowlister.WorkflowLister.read_workflow_details()
+    def run():
+        workflowlister.WorkflowLister._catalog = None
+        if os.path.exists(workflowlister.WorkflowLister.catalog_path):
+            os.remove(workflowlister.WorkflowLister.catalog_path)
+        workflowlister.WorkflowLister.find_workflows(cloud='openstack', env='collaboratory')
+    return run
+
+def bench_workflows_config(env, num_INIs=10000):
+    "'workflows config' writing 10k HelloWorld INI files."
+    import workflowlister
+    from commands.workflows import Workflows
+    listing = synthetic_listing(1)
+    listing['HelloWorld_1.0-SNAPSHOT'] = listing.pop('Synthetic_0')
+    # Pretend that this is the listing from the server, so that only HelloWorld is used.
+    url = workflowlister.WorkflowLister._read_config()['workflow_listing_url']
+    ini_dir = os.path.join(env.home, 'ini-dir')
+    command = Workflows(None, None)
+    def run():
+        workflowlister.WorkflowLister._use(url, listing, time.time())
+        for f in os.listdir(ini_dir):
+            os.remove(os.path.join(ini_dir, f))
+        command._do_config('HelloWorld_1.0-SNAPSHOT', num_INIs, False)
+    return run
+
+def bench_generator_config_update(env):
+    "The generator's params.json and youxia config updates for one workflow."
+    import workflowlister
+    from commands.generator import Generator
+    Generator.params_path = os.path.join(env.home, 'params.json')
+    Generator.youxia_config_path = os.path.join(env.home, '.youxia', 'config')
+    _reset_listing()
+    workflowlister.WorkflowLister.read_workflow_details()
+    workflow_details = workflowlister.WorkflowLister.get_workflow_details('Synthetic_0')
+    cloud_specific_details = workflow_details['cloud-specific-details']['aws']
+    command = Generator(None, None)
+    def run():
+        command._update_params([('Synthetic_0', workflow_details)], cloud_specific_details)
+        command._update_youxia_config('AWS', cloud_specific_details)
+    return run
+
+# (name, setup, whether it writes files). The time it takes to write files varies a lot from run to run on a busy or virtual disk,
+# so those benchmarks are compared with --disk-tolerance instead of --tolerance.
+benchmarks = [('config_render', bench_config_render, True),
+              ('config_up_to_date', bench_config_up_to_date, False),
+              ('listing_download', bench_listing_download, True),
+              ('listing_cached', bench_listing_cached, False),
+              ('listing_catalog', bench_listing_catalog, True),
+              ('workflows_config_10k', bench_workflows_config, True),
+              ('generator_config_update', bench_generator_config_update, True)]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Pancancer CLI hot path benchmarks')
+    parser.add_argument('--repeat', type=int, default=7, help='How many times to run each benchmark (the median is used). Each one is also run once beforehand, and that run is not counted.')
+    parser.add_argument('--workflows', type=int, default=5000, help='The number of workflows in the synthetic listing.')
+    parser.add_argument('--only', help='Only run the benchmarks whose names contain this.')
+    parser.add_argument('--write-baseline', action='store_true', help='Write the current times to '+baseline_path)
+    parser.add_argument('--tolerance', type=float, default=1.5, help='A benchmark is a regression if it is this many times slower than its baseline.')
+    parser.add_argument('--disk-tolerance', type=float, default=4.0, help='The --tolerance for the benchmarks that write files.')
+    parser.add_argument('--floor', type=float, default=5.0, help='A benchmark is never a regression if it is less than this many milliseconds slower than its baseline.')
+    args = parser.parse_args(argv)
+
+    import logging
+    # The commands log every file they write at INFO level.
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {}
+    env = Environment(args.workflows)
+    try:
+        for name, setup, writes_files in benchmarks:
+            if args.only and args.only not in name:
+                continue
+            run = setup(env)
+            # The first run fills the caches (the OS's and Python's) that the later ones find full.
+            run()
+            times = []
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                run()
+                times.append((time.perf_counter() - start) * 1000)
+            results[name] = statistics.median(times)
+    finally:
+        env.close()
+
+    baseline = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.write_baseline:
+        baseline.update({k: round(v, 1) for k, v in results.items()})
+        with open(baseline_path, 'w') as baseline_file:
+            baseline_file.write(json.dumps(baseline, sort_keys=True, indent=4)+'\n')
+        print('Baseline written to '+baseline_path)
+
+    tolerances = {name: args.disk_tolerance if writes_files else args.tolerance for name, setup, writes_files in benchmarks}
+    regressed = False
+    for name, ms in sorted(results.items()):
+        base = baseline.get(name)
+        status = ''
+        if base is not None and ms > base * tolerances[name] and ms - base >= args.floor:
+            status = 'REGRESSION'
+            regressed = True
+        print('{:<26} {:>10.1f} ms  {:>18}  {}'.format(name, ms, ('baseline '+str(base)) if base is not None else 'no baseline', status))
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,309 @@
+#! /usr/bin/python3
+"""An end-to-end load simulation: runs the pancancer CLI against a simulated launcher, and measures how long the generator, status, reports
+and services commands take with a realistic amount of data.
+
+The simulated launcher is a directory (--dir, or a temporary one) that takes the place of /home/ubuntu (see launcher.py). It has:
+ - a copy of the scripts directory, which is what is run (sysconfig writes the rendered config files next to process_config.py),
+ - the queue database: a SQLite database with --jobs rows in the job table, which the CLI uses through PANCANCER_QUEUE_DB,
+ - the RabbitMQ management API: a stub on 127.0.0.1:15672 that answers after --rabbitmq-latency seconds,
+ - the workflow listing, served by a local HTTP server,
+ - stand-ins for Generator, Coordinator, Provisioner and java (see fake_launcher.py) in its bin directory, which the CLI uses through PANCANCER_BIN_DIR.
+Each scenario is run as a new 'pancancer --profile-file ...' process, --repeat times. The median time is printed, with the phases that took the longest.
+
+    python3 benchmarks/simulate.py                            # 1 million jobs, every scenario
+    python3 benchmarks/simulate.py --jobs 100000 --only status
+    python3 benchmarks/simulate.py --dir /tmp/sim             # keep the simulated launcher (the database is reused unless --jobs or --vms change)
+"""
+import argparse
+import datetime
+import hashlib
+import http.server
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from hotpaths import StubServer, scripts_dir
+
+fake_launcher_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_launcher.py')
+workflow_names = ['HelloWorld_1.0-SNAPSHOT', 'Sanger_1.0.8', 'BWA_2.6.6', 'DKFZ_EMBL_1.0.6', 'Broad_1.0.0']
+# The share of the jobs in each status, roughly what a launcher looks like after a long run.
+job_statuses = [('SUCCESS', 0.93), ('FAILED', 0.04), ('PENDING', 0.02), ('RUNNING', 0.01)]
+
+def build_queue_db(path, num_jobs, num_vms):
+    "Create the job and provision tables (as arch3 has them in PostgreSQL) in a SQLite database, with num_jobs jobs and num_vms VMs."
+    connection = sqlite3.connect(path)
+    connection.execute('pragma synchronous = off')
+    connection.execute('create table job (job_id integer primary key, status text, job_uuid text, workflow text, workflow_version text, job_hash text, ini text, '
+                       'messagetype text, create_timestamp text, update_timestamp text, stdout text, stderr text)')
+    connection.execute('create table provision (provision_id integer primary key, status text, provision_uuid text, ip_address text, job_uuid text, '
+                       'cores integer, mem_gb integer, storage_gb integer, create_timestamp text, update_timestamp text)')
+    connection.execute('create table simulation (setting text primary key, value integer)')
+    rng = random.Random(0)
+    now = datetime.datetime.now().replace(microsecond=0)
+    start = now - datetime.timedelta(days=365)
+    statuses = [s for s, share in job_statuses]
+    weights = [share for s, share in job_statuses]
+    running = []
+    def jobs():
+        for i in range(num_jobs):
+            status = rng.choices(statuses, weights)[0]
+            workflow = workflow_names[i % len(workflow_names)]
+            ini = 'sample_id=SIM'+str(i)+'\ninput_file=s3://bucket/SIM'+str(i)+'.bam\noutput_prefix=./\noutput_dir=results/'+str(i)+'\n'
+            created = start + datetime.timedelta(seconds=i * 365 * 86400 // num_jobs)
+            if status == 'PENDING':
+                updated, stdout = created, None
+            elif status == 'RUNNING':
+                updated, stdout = now - datetime.timedelta(minutes=rng.randint(1, 120)), 'Running step '+str(rng.randint(1, 11))+' of 12\n'
+            else:
+                updated = created + datetime.timedelta(hours=rng.uniform(2, 12))
+                stdout = 'Running step 12 of 12\nThe workflow has '+('finished' if status == 'SUCCESS' else 'failed')+'\n'
+            job_uuid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            if status == 'RUNNING' and len(running) < num_vms:
+                running.append(job_uuid)
+            yield (i+1, status, job_uuid, workflow, workflow.split('_', 1)[1], hashlib.md5(ini.encode('utf-8')).hexdigest(), ini,
+                   'job', str(created), str(updated), stdout, '' if stdout is not None else None)
+    with connection:
+        connection.executemany('insert into job values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', jobs())
+        connection.executemany('insert into provision values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               ((i+1, 'RUNNING', str(uuid.UUID(int=rng.getrandbits(128), version=4)), '10.0.'+str(i // 250)+'.'+str(i % 250 + 1), job_uuid,
+                                 8, 32, 500, str(now - datetime.timedelta(hours=2)), str(now)) for i, job_uuid in enumerate(running)))
+        connection.executemany('insert into simulation values (?, ?)', [('jobs', num_jobs), ('vms', num_vms)])
+    # The CLI reads the database while the fake daemons write to it.
+    connection.execute('pragma journal_mode = wal')
+    connection.close()
+
+def queue_db_settings(path):
+    try:
+        connection = sqlite3.connect('file:'+path+'?mode=ro', uri=True)
+        try:
+            return dict(connection.execute('select setting, value from simulation'))
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+
+class RabbitMQStub:
+    "The parts of the RabbitMQ management API that the CLI uses, on its default port. Every request takes latency seconds."
+    port = 15672
+
+    def __init__(self, num_queues, messages, latency):
+        queues = []
+        for i in range(num_queues):
+            name = 'pancancer_arch_3' if i == 0 else 'pancancer_arch_3_'+str(i)
+            queue_messages = messages // num_queues + (1 if i < messages % num_queues else 0)
+            queues.append({'vhost':'/', 'name':name, 'node':'rabbit@launcher', 'messages':queue_messages, 'messages_ready':queue_messages,
+                           'messages_unacknowledged':0, 'consumers':1,
+                           'message_stats':{'publish_details':{'rate':2.0}, 'deliver_get_details':{'rate':1.5}}})
+        body = json.dumps(queues).encode('utf-8')
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def do_GET(self):
+                time.sleep(latency)
+                if self.path == '/api/queues' or self.path.startswith('/api/queues/'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_error(404)
+            def log_message(self, format, *args):
+                pass
+        try:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', RabbitMQStub.port), Handler)
+        except OSError as e:
+            raise RuntimeError('Could not listen on port '+str(RabbitMQStub.port)+' for the RabbitMQ management API stub ('+str(e)+'). Is RabbitMQ running here?')
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class SimulatedLauncher:
+    "A directory that looks like /home/ubuntu on a launcher, the servers and the environment that the CLI needs to run against it."
+    def __init__(self, args):
+        self.temporary = args.dir is None
+        self.base_dir = os.path.abspath(args.dir) if args.dir is not None else tempfile.mkdtemp(prefix='pancancer_sim_')
+        self.bin_dir = os.path.join(self.base_dir, 'bin')
+        self.cli_dir = os.path.join(self.base_dir, 'cli')
+        self.queue_db_path = os.path.join(self.base_dir, 'queue_status.db')
+        self.profile_path = os.path.join(self.base_dir, 'profile.jsonl')
+        for d in ('.pancancer', '.youxia', '.aws', '.gnos', 'arch3/config', 'ini-dir', 'run', 'host_config', 'bin', 'www'):
+            os.makedirs(os.path.join(self.base_dir, d), exist_ok=True)
+
+        settings = queue_db_settings(self.queue_db_path) if os.path.isfile(self.queue_db_path) else None
+        if settings != {'jobs':args.jobs, 'vms':args.vms}:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.queue_db_path+suffix):
+                    os.remove(self.queue_db_path+suffix)
+            print('Building a queue database with '+'{:,}'.format(args.jobs)+' jobs in '+self.queue_db_path, file=sys.stderr)
+            start = time.perf_counter()
+            build_queue_db(self.queue_db_path, args.jobs, args.vms)
+            print('Built in '+'{:.1f}'.format(time.perf_counter() - start)+' seconds', file=sys.stderr)
+        connection = sqlite3.connect(self.queue_db_path)
+        pending = connection.execute("select count(*) from job where status = 'PENDING'").fetchone()[0]
+        connection.close()
+
+        # The CLI that is run is a copy, because sysconfig writes the rendered config files into the scripts directory.
+        if os.path.exists(self.cli_dir):
+            shutil.rmtree(self.cli_dir)
+        # The config files that an earlier sysconfig rendered into scripts/ are left out, as they would be in a clean checkout.
+        shutil.copytree(scripts_dir, self.cli_dir, ignore=shutil.ignore_patterns('__pycache__', 'benchmarks', 'params.json', 'youxia_config', 'masterConfig.ini', 'pancancer_config.json'))
+        for program in ('Generator', 'Coordinator', 'Provisioner', 'java'):
+            program_path = os.path.join(self.bin_dir, program)
+            with open(program_path, 'w') as program_file:
+                program_file.write('#!/bin/sh\nexec '+sys.executable+' '+fake_launcher_path+' '+program+' "$@"\n')
+            os.chmod(program_path, 0o755)
+
+        with open(os.path.join(scripts_dir, '..', 'config', 'workflowlist.json')) as listing_file:
+            listing = json.load(listing_file)
+        with open(os.path.join(self.base_dir, 'www', 'workflowlist.json'), 'w') as listing_file:
+            json.dump(listing, listing_file)
+        self.listing_server = StubServer(os.path.join(self.base_dir, 'www'))
+        self.rabbitmq = RabbitMQStub(args.queues, pending, args.rabbitmq_latency)
+
+        # What install_bootstrap and an earlier sysconfig would have left behind, so that sysconfig (which the generator runs) does not ask anything.
+        listing_url = self.listing_server.url+'workflowlist.json'
+        with open(os.path.join(self.base_dir, 'host_config', 'pancancer.config'), 'w') as bootstrap_file:
+            bootstrap_file.write('CLOUD_ENV="AWS"\nPEM_PATH="'+os.path.join(self.base_dir, '.ssh', 'sim.pem')+'"\nKEY_NAME="sim"\nFLEET_SIZE="'+str(args.vms)+'"\n'
+                                 'WORKFLOW_LISTING_URL="'+listing_url+'"\nSECURITY_GROUP="default"\n')
+        with open(os.path.join(self.base_dir, '.aws', 'config'), 'w') as aws_config_file:
+            aws_config_file.write('[default]\naws_access_key_id=SIMULATED\naws_secret_access_key=SIMULATED\n')
+        simple_config = {'max_fleet_size':str(args.vms), 'path_to_key':os.path.join(self.base_dir, '.ssh', 'sim.pem'), 'name_of_key':'sim',
+                         'security_group':'default', 'cloud_env':'AWS', 'workflow_listing_url':listing_url,
+                         'aws_key':'SIMULATED', 'aws_secret_key':'SIMULATED', 'spot_price':'0.001'}
+        simple_config_path = os.path.join(self.base_dir, '.pancancer', 'simple_pancancer_config.json')
+        with open(simple_config_path, 'w') as simple_config_file:
+            json.dump(simple_config, simple_config_file)
+        self.env = dict(os.environ)
+        self.env.update({'HOME':self.base_dir,
+                         'PANCANCER_BASE_DIR':self.base_dir,
+                         'PANCANCER_RUN_DIR':os.path.join(self.base_dir, 'run'),
+                         'PANCANCER_HOST_CONFIG_DIR':os.path.join(self.base_dir, 'host_config'),
+                         'PANCANCER_BIN_DIR':self.bin_dir,
+                         'PANCANCER_QUEUE_DB':self.queue_db_path,
+                         'PANCANCER_SIM_JVM_STARTUP':str(args.jvm_startup),
+                         'PANCANCER_SIM_SECONDS_PER_INI':str(args.seconds_per_ini),
+                         'SENSU_SERVER_IP_ADDRESS':'127.0.0.1',
+                         'FLEET_NAME':'sim',
+                         'HOST_ENV':'AWS'})
+        # Deploy the config files with sysconfig, as an earlier sysconfig would have.
+        subprocess.run([sys.executable, os.path.join(self.cli_dir, 'pancancer.py'), 'sysconfig', '--config', simple_config_path],
+                       env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+    def pancancer(self, cli_args):
+        "Run 'pancancer <cli_args>' against the simulated launcher. Returns (seconds, return code, stderr, the --profile records)."
+        offset = os.path.getsize(self.profile_path) if os.path.isfile(self.profile_path) else 0
+        # stderr goes to a file rather than a pipe, because the daemons that a command starts keep it open after the command has exited.
+        stderr_path = os.path.join(self.base_dir, 'stderr.log')
+        with open(stderr_path, 'w') as stderr_file:
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, os.path.join(self.cli_dir, 'pancancer.py'), '--profile-file', self.profile_path]+cli_args,
+                                     env=self.env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            seconds = time.perf_counter() - start
+        with open(stderr_path, errors='replace') as stderr_file:
+            stderr = stderr_file.read()
+        records = []
+        if os.path.isfile(self.profile_path):
+            with open(self.profile_path) as profile_file:
+                profile_file.seek(offset)
+                records = [json.loads(line) for line in profile_file if line.strip()]
+        return seconds, process.returncode, stderr, records
+
+    def write_inis(self, num_INIs, tag):
+        "Replace the INIs in ini-dir with num_INIs new HelloWorld INIs. tag makes them different from the INIs of earlier runs."
+        ini_dir = os.path.join(self.base_dir, 'ini-dir')
+        shutil.rmtree(ini_dir)
+        os.makedirs(ini_dir)
+        for i in range(num_INIs):
+            with open(os.path.join(ini_dir, 'sim_'+str(i)+'.ini'), 'w') as ini_file:
+                ini_file.write('sample_id='+tag+'_'+str(i)+'\ninput_file=s3://bucket/'+tag+'_'+str(i)+'.bam\noutput_prefix=./\noutput_dir=results\n')
+
+    def close(self):
+        # Stop any fake daemons that the scenarios started.
+        self.pancancer(['services', 'stop', '--all', '--grace-period', '5'])
+        self.rabbitmq.stop()
+        self.listing_server.stop()
+        if self.temporary:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+
+# Each scenario is a name, the pancancer arguments, and what has to be done before each run (that is not timed).
+scenarios = [('status_job_status', ['status', 'job_status'], None),
+             ('status_jobs_running', ['status', 'jobs', '--status', 'RUNNING', '-f', 'value'], None),
+             ('status_jobs_page', ['status', 'jobs', '--after-job-id', '500000', '--limit', '1000', '-f', 'value'], None),
+             ('status_jobs_all', ['status', 'jobs', '-f', 'csv'], None),
+             ('status_queues', ['status', 'queues'], None),
+             ('status_services', ['status', 'services'], None),
+             ('reports_jobs', ['reports', 'jobs', '--max-age', '0'], None),
+             ('reports_status', ['reports', 'status', '--max-age', '0'], None),
+             ('reports_gather', ['reports', 'gather', '--max-age', '0'], None),
+             ('reports_info_java', ['reports', 'info'], None),
+             ('services_restart', ['services', 'restart', '--all', '--grace-period', '5'], None),
+             ('generator_plan', ['generator', '--workflow', 'HelloWorld_1.0-SNAPSHOT', '--plan', '--non-interactive'], 'inis'),
+             ('generator', ['generator', '--workflow', 'HelloWorld_1.0-SNAPSHOT', '--non-interactive'], 'inis')]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Pancancer CLI end-to-end load simulation')
+    parser.add_argument('--dir', help='The directory for the simulated launcher. By default, a temporary directory is used and removed afterwards.')
+    parser.add_argument('--jobs', type=int, default=1000000, help='The number of jobs in the queue database.')
+    parser.add_argument('--vms', type=int, default=50, help='The number of worker VMs (the fleet size, and the number of provisioned VMs).')
+    parser.add_argument('--queues', type=int, default=3, help='The number of queues in RabbitMQ.')
+    parser.add_argument('--inis', type=int, default=1000, help='The number of INI files to generate jobs for in the generator scenarios.')
+    parser.add_argument('--repeat', type=int, default=3, help='How many times to run each scenario (the median is used).')
+    parser.add_argument('--only', help='Only run the scenarios whose names contain this.')
+    parser.add_argument('--jvm-startup', dest='jvm_startup', type=float, default=0.8, help='How many seconds the fake Java programs take to start.')
+    parser.add_argument('--seconds-per-ini', dest='seconds_per_ini', type=float, default=0.005, help='How many seconds the fake Generator takes for each INI.')
+    parser.add_argument('--rabbitmq-latency', dest='rabbitmq_latency', type=float, default=0.02, help='How many seconds the RabbitMQ management API stub takes to answer.')
+    parser.add_argument('--json', dest='json_path', help='Also write the results to this file, as JSON.')
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = False
+    launcher = SimulatedLauncher(args)
+    try:
+        for name, cli_args, setup in scenarios:
+            if args.only and args.only not in name:
+                continue
+            times = []
+            phases = {}
+            for i in range(args.repeat):
+                if setup == 'inis':
+                    launcher.write_inis(args.inis, name+'_'+str(i)+'_'+uuid.uuid4().hex[:8])
+                seconds, returncode, stderr, records = launcher.pancancer(cli_args)
+                if returncode != 0:
+                    print(name+' failed with exit code '+str(returncode)+':\n'+stderr[-2000:], file=sys.stderr)
+                    failed = True
+                    break
+                times.append(seconds * 1000)
+                run_phases = {}
+                for record in records:
+                    if record['phase'] != 'command':
+                        run_phases[record['phase']] = run_phases.get(record['phase'], 0) + record['seconds'] * 1000
+                for phase, ms in run_phases.items():
+                    phases.setdefault(phase, []).append(ms)
+            if times:
+                results[name] = {'ms':statistics.median(times), 'max_ms':max(times), 'phases':{k: statistics.median(v) for k, v in phases.items()}}
+    finally:
+        launcher.close()
+
+    print('{:<22} {:>10} {:>10}  {}'.format('scenario', 'median ms', 'max ms', 'slowest phases (median ms)'))
+    for name, result in results.items():
+        slowest = sorted(result['phases'].items(), key=lambda p: p[1], reverse=True)[:3]
+        print('{:<22} {:>10.1f} {:>10.1f}  {}'.format(name, result['ms'], result['max_ms'], ', '.join(k+' '+'{:.1f}'.format(v) for k, v in slowest)))
+    if args.json_path is not None:
+        with open(args.json_path, 'w') as json_file:
+            json_file.write(json.dumps({'settings':vars(args), 'results':results}, sort_keys=True, indent=4)+'\n')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,99 @@
+#! /usr/bin/python3
+"""Measures how long the pancancer CLI takes to run a quick command ('pancancer status services'), and how long each command module
+takes to import. The results are compared against the budget in startup_budget.json, and the exit code is 1 if anything is over budget,
+or if the command imported any command module other than its own. ('pancancer --help' is not used, because cliff's help loads every command.)
+
+    python3 benchmarks/startup.py                  # check against the budget
+    python3 benchmarks/startup.py --write-budget   # record the current times (plus headroom) as the new budget
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scripts_dir)
+import pancancer
+
+budget_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+
+# Each import is timed in a new interpreter that has already imported cliff (as pancancer.py always does), so only the cost of the command itself is measured.
+import_timer = 'import time, cliff.app, cliff.command, cliff.lister; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)'
+
+# The command that is timed, and the only command module that it should import.
+command = ['status', 'services']
+command_module = 'commands.status'
+
+def time_command(repeat):
+    "Median wall time, in ms, of 'pancancer <command>'."
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        # Its exit code is not checked: it is 1 if the services are not running, which they usually aren't where this is run.
+        subprocess.call([sys.executable, os.path.join(scripts_dir, 'pancancer.py')]+command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def imported_command_modules():
+    "The command modules that 'pancancer <command>' imports."
+    # pancancer.py is run in an interpreter that then prints the command modules that are in sys.modules, as its last line of stderr.
+    # (-X importtime can't be used for this, because it does not see modules that are imported with importlib.import_module.)
+    checker = ('import runpy, sys\n'
+               'sys.argv = [{path!r}]+{command!r}\n'
+               'try:\n'
+               '    runpy.run_path(sys.argv[0], run_name="__main__")\n'
+               'except SystemExit:\n'
+               '    pass\n'
+               'print(" ".join(m for m in sys.modules if m.startswith("commands.")), file=sys.stderr)').format(path=os.path.join(scripts_dir, 'pancancer.py'), command=command)
+    process = subprocess.run([sys.executable, '-c', checker], cwd=scripts_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    return set(process.stderr.splitlines()[-1].split())
+
+def time_import(module, repeat):
+    "Median time, in ms, to import module."
+    times = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', import_timer.format(module=module)], cwd=scripts_dir, universal_newlines=True)
+        times.append(float(output.strip()) * 1000)
+    return statistics.median(times)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Pancancer CLI startup benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='How many times to run each measurement (the median is used).')
+    parser.add_argument('--write-budget', action='store_true', help='Write the current times, plus --headroom, to '+budget_path)
+    parser.add_argument('--headroom', type=float, default=1.5, help='The budget is the current time multiplied by this.')
+    args = parser.parse_args(argv)
+
+    results = {'pancancer '+' '.join(command): time_command(args.repeat)}
+    for module in sorted(set(path.split(':')[0] for path in pancancer.commands.values())):
+        results['import '+module] = time_import(module, args.repeat)
+
+    if args.write_budget:
+        with open(budget_path, 'w') as budget_file:
+            budget_file.write(json.dumps({k: round(v * args.headroom, 1) for k, v in results.items()}, sort_keys=True, indent=4)+'\n')
+        print('Budget written to '+budget_path)
+
+    budget = {}
+    if os.path.isfile(budget_path):
+        with open(budget_path) as budget_file:
+            budget = json.load(budget_file)
+    over_budget = False
+    for name, ms in sorted(results.items()):
+        limit = budget.get(name)
+        status = ''
+        if limit is not None and ms > limit:
+            status = 'OVER BUDGET'
+            over_budget = True
+        print('{:<32} {:>8.1f} ms  {:>10}  {}'.format(name, ms, ('budget '+str(limit)) if limit is not None else 'no budget', status))
+
+    # Lazy loading only works if running a command imports nothing but that command's module.
+    extra_modules = imported_command_modules() - {command_module}
+    if extra_modules:
+        print('pancancer '+' '.join(command)+' also imported: '+', '.join(sorted(extra_modules)))
+        over_budget = True
+    return 1 if over_budget else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,81 +1,220 @@
 import os
 import subprocess
+import signal
 import logging
+import profiler
+import launcher
 import cliff.command
 import time
 import psutil
+import hashlib
+import fcntl
+import re
+import socket
+import concurrent.futures
+
+def add_start_arguments(parser, service_name):
+    "Add the options for starting a service to a parser."
+    parser.add_argument('--timeout',dest='timeout',help='How many seconds to wait for the '+service_name+' service to be ready.',required=False,type=float,default=30)
+    parser.add_argument('--ready-log',dest='ready_log',help='A log file to watch for a line that shows the service is ready (use with --ready-pattern).',required=False)
+    parser.add_argument('--ready-pattern',dest='ready_pattern',help='A regular expression that matches the line in --ready-log that shows the service is ready.',required=False)
+    parser.add_argument('--ready-port',dest='ready_port',help='A local port that the service listens on when it is ready.',required=False,type=int)
+
+def add_stop_arguments(parser):
+    "Add the options for stopping a service to a parser."
+    parser.add_argument('--grace-period',dest='grace_period',help='How many seconds to let a service shut down cleanly before it is killed.',required=False,type=float,default=30)
 
 class DaemonCommand(cliff.command.Command):
     "Parent class for commands that start/stop daemons"
     service_name=''
+    # The config files that the service reads when it starts. If none of these have changed, there is no need to restart it.
+    config_files=[launcher.master_config_path]
+    # How to tell that the service is ready: a regular expression to look for in a log file, or a port to connect to.
+    ready_log=None
+    ready_pattern=None
+    ready_port=None
+    # The service must stay up for at least this many seconds before it is considered started.
+    min_uptime=1
     log = logging.getLogger(__name__)
 
-    def _do_start(self):
-        "Start a process, using flock to ensure that it can't be started multiple times."
-        start_cmd='flock -n /tmp/arch3_'+self.service_name+'.lock ' +self.service_name+' --config /home/ubuntu/arch3/config/masterConfig.ini --endless'
-        self.log.debug (start_cmd)
-        pid_file_path='/tmp/arch3_'+self.service_name+'.pid'
+    def _config_digest(self):
+        "Returns a digest of the contents of the config files used by the service."
+        h = hashlib.sha256()
+        for config_file in self.config_files:
+            h.update((config_file+'\0').encode('utf-8'))
+            if os.path.isfile(config_file):
+                with open(config_file,'rb') as f:
+                    h.update(f.read())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _is_running(self):
+        "Returns True if there is a pid file for the service and the process in it is still running."
+        pid_file_path=launcher.run_file(self.service_name,'pid')
+        if not os.path.isfile(pid_file_path):
+            return False
+        with open(pid_file_path,'r') as pidfile:
+            pid = pidfile.readline().strip()
+        return pid.isdigit() and psutil.pid_exists(int(pid))
+
+    def _config_changed(self):
+        "Returns True if the config files are different from the ones the running service was started with."
+        config_digest_path=launcher.run_file(self.service_name,'config')
+        if not os.path.isfile(config_digest_path):
+            return True
+        with open(config_digest_path,'r') as config_digest_file:
+            return config_digest_file.readline().strip() != self._config_digest()
+
+    def _lock_is_held(self):
+        "Returns True if something (the flock started by _do_start) is holding the service's lock file."
+        lock_file_path=launcher.run_file(self.service_name,'lock')
+        if not os.path.isfile(lock_file_path):
+            return False
+        with open(lock_file_path,'r') as lock_file:
+            try:
+                fcntl.flock(lock_file,fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(lock_file,fcntl.LOCK_UN)
+            return False
+
+    def _is_ready(self, log_offset):
+        "Returns True if the service's readiness check passes: a line matching ready_pattern in ready_log, or a connection to ready_port. If neither is configured, holding the lock is enough."
+        if self.ready_log is not None and self.ready_pattern is not None:
+            if not os.path.isfile(self.ready_log):
+                return False
+            with open(self.ready_log,'r',errors='replace') as log_file:
+                log_file.seek(log_offset)
+                return re.search(self.ready_pattern,log_file.read()) is not None
+        if self.ready_port is not None:
+            try:
+                socket.create_connection(('127.0.0.1',self.ready_port),timeout=0.5).close()
+                return True
+            except OSError:
+                return False
+        return True
+
+    def _do_start(self, timeout=30):
+        "Start a process, using flock to ensure that it can't be started multiple times. Returns True if the service was started."
+        start_cmd=['flock','-n',launcher.run_file(self.service_name,'lock'),launcher.command(self.service_name),'--config',launcher.master_config_path,'--endless']
+        self.log.debug (' '.join(start_cmd))
+        pid_file_path=launcher.run_file(self.service_name,'pid')
+        # Only log lines written after the service is started count towards readiness.
+        log_offset=0
+        if self.ready_log is not None and os.path.isfile(self.ready_log):
+            log_offset=os.path.getsize(self.ready_log)
         # set start_new_session=True so that we can kill flock and all it's child processes by killing the process group whose pgid is the same as the flock pid.
         # We don't want to use subprocess.call() or check_call() here because those will wait for the command to complete. Since the child process will run in "endless" mode,
         # we really don't want *this* script to run endlessly - we want to start the child and let it keep running in the background.
-        p = subprocess.Popen(start_cmd.split(' '),start_new_session=True)
-        # Wait a moment... if we get ANY response, it means that the process did not start, probably because it's already been started.
-        time.sleep(4)
-        p.poll()
+        p = subprocess.Popen(start_cmd,start_new_session=True)
+        # Poll with a short backoff until the service is up or has exited. If flock exits with 1, it means that the process did not start, probably because it's already been started.
+        start_time=time.time()
+        delay=0.1
+        ready=False
+        while p.poll() is None and time.time()-start_time < timeout:
+            if time.time()-start_time >= self.min_uptime and self._lock_is_held() and self._is_ready(log_offset):
+                ready=True
+                break
+            time.sleep(delay)
+            delay=min(delay*2,0.5)
 
         if p.returncode==1:
             self.log.info('The '+self.service_name+' process might already be running.')
-        else:
-            self.log.debug('pid: '+str(p.pid))
-            self.log.info('The service has been started, check the log files for more detail.')
-            # ONLY if the service was started new (and not already running) write a pid file so we will know which processes to kill later.
-            with open(pid_file_path,'w') as pidfile:
-                pidfile.write(str(p.pid))
+            return False
+        elif p.returncode is not None:
+            self.log.error('The '+self.service_name+' process exited with code '+str(p.returncode)+' while starting, check the log files for more detail.')
+            return False
 
+        self.log.debug('pid: '+str(p.pid))
+        if ready:
+            self.log.info('The '+self.service_name+' service has been started in '+'{:.1f}'.format(time.time()-start_time)+' seconds, check the log files for more detail.')
+        else:
+            self.log.warn('The '+self.service_name+' service is running, but was not confirmed to be ready after '+str(timeout)+' seconds, check the log files for more detail.')
+        # ONLY if the service was started new (and not already running) write a pid file so we will know which processes to kill later.
+        with open(pid_file_path,'w') as pidfile:
+            pidfile.write(str(p.pid))
+        # Remember which config the service was started with, so that "restart --if-changed" can tell if a restart is needed.
+        with open(launcher.run_file(self.service_name,'config'),'w') as config_digest_file:
+            config_digest_file.write(self._config_digest())
+        return True
 
-    def _do_stop(self):
-        "Stop a process."
-        stop_cmd='kill -KILL -'
+    def _do_stop(self, grace_period=30):
+        """Stop a process. The whole process group is sent SIGTERM so that the service can shut down cleanly, and is only sent SIGKILL if it is still running after grace_period seconds.
+        Returns the number of seconds it took to stop the service, or None if it was not running."""
         pid = ''
         # Read the pid from the file.
-        pid_file_path='/tmp/arch3_'+self.service_name+'.pid'
+        pid_file_path=launcher.run_file(self.service_name,'pid')
         if os.path.isfile(pid_file_path):
             with open(pid_file_path,'r') as pidfile:
-                pid = pidfile.readline()
-
-            stop_cmd += pid
-            self.log.debug (stop_cmd)
+                pid = pidfile.readline().strip()
 
             self.log.debug('pid: '+pid)
 
             if psutil.pid_exists(int(pid)):
-                returncode = subprocess.call(stop_cmd.split(' '))
-                if returncode == 0:
-                    self.log.info ('The '+self.service_name+' process has been stopped.')
-                    self._clean_up_pid_and_lock()
+                start_time=time.time()
+                # The flock process was started in a new session, so its pid is also the pgid of the service and all of its children.
+                try:
+                    leader=psutil.Process(int(pid))
+                    processes=[leader]+leader.children(recursive=True)
+                except psutil.NoSuchProcess:
+                    processes=[]
+                forced=False
+                try:
+                    self.log.debug('sending SIGTERM to process group '+pid)
+                    os.killpg(int(pid),signal.SIGTERM)
+                    gone, alive = psutil.wait_procs(processes,timeout=grace_period)
+                    if alive:
+                        self.log.info('The '+self.service_name+' process did not stop within '+str(grace_period)+' seconds, killing it.')
+                        forced=True
+                        os.killpg(int(pid),signal.SIGKILL)
+                        psutil.wait_procs(alive,timeout=5)
+                except ProcessLookupError:
+                    # The process group exited on its own.
+                    pass
+                elapsed=time.time()-start_time
+                self.log.info ('The '+self.service_name+' process has been '+('killed' if forced else 'stopped')+' in '+'{:.1f}'.format(elapsed)+' seconds.')
+                self._clean_up_pid_and_lock()
+                return elapsed
             else:
                 self.log.info('The '+self.service_name+' process with PID '+pid+' does not appear to be running.')
                 # If the process is not running, clean up any .lock files that may have been left behind.
                 self._clean_up_pid_and_lock()
         else:
             self.log.info('The '+self.service_name+' process does not appear to be running.')
+        return None
 
     def _clean_up_pid_and_lock(self):
         "Remove the .pid and .lock files."
-        pid_file_path='/tmp/arch3_'+self.service_name+'.pid'
-        lock_file_path='/tmp/arch3_'+self.service_name+'.lock'
-        os.remove(pid_file_path)
-        os.remove(lock_file_path)
+        pid_file_path=launcher.run_file(self.service_name,'pid')
+        lock_file_path=launcher.run_file(self.service_name,'lock')
+        config_digest_path=launcher.run_file(self.service_name,'config')
+        for path in (pid_file_path, lock_file_path, config_digest_path):
+            if os.path.isfile(path):
+                os.remove(path)
 
     def get_parser(self,prog_name):
         parser = super(DaemonCommand,self).get_parser(prog_name)
         subparser = parser.add_subparsers(title='subcommands',help='coordinator subcommands: start, stop, restart',dest='service_state')
         subparser.required=True
-        subparser.add_parser('start',help='Start the '+self.service_name+' service')
-        subparser.add_parser('stop',help='Stop the '+self.service_name+' service')
-        subparser.add_parser('restart',help='Stop and then start the '+self.service_name+' service')
+        start_parser = subparser.add_parser('start',help='Start the '+self.service_name+' service')
+        stop_parser = subparser.add_parser('stop',help='Stop the '+self.service_name+' service')
+        restart_parser = subparser.add_parser('restart',help='Stop and then start the '+self.service_name+' service')
+        for p in (start_parser, restart_parser):
+            add_start_arguments(p, self.service_name)
+        for p in (stop_parser, restart_parser):
+            add_stop_arguments(p)
+        restart_parser.add_argument('--if-changed',dest='if_changed',help='Only restart the '+self.service_name+' service if its config files have changed since it was started.',required=False,action='store_true')
         return parser
 
+    def _set_ready_check(self, parsed_args):
+        "Use the readiness check from the command line, if one was given."
+        args=vars(parsed_args)
+        if args.get('ready_log') is not None:
+            self.ready_log=args['ready_log']
+            self.ready_pattern=args['ready_pattern']
+        if args.get('ready_port') is not None:
+            self.ready_port=args['ready_port']
+
     def take_action(self, parsed_args):
         subparser_name=vars(parsed_args)['service_state']
         self.log.debug('working on service: '+self.service_name)
@@ -84,20 +223,29 @@ class DaemonCommand(cliff.command.Command):
         
         # Negate the PID of the process to kill the process group.
         
+        self._set_ready_check(parsed_args)
         if subparser_name=='start':
-            self._do_start()
+            with profiler.Profiler.phase('daemon_start', service=self.service_name):
+                self._do_start(vars(parsed_args)['timeout'])
         elif subparser_name=='stop':
-            self._do_stop()
+            with profiler.Profiler.phase('daemon_stop', service=self.service_name):
+                self._do_stop(vars(parsed_args)['grace_period'])
         elif subparser_name=='restart':
-            self._do_stop()
-            self._do_start()
+            if vars(parsed_args)['if_changed'] and self._is_running() and not self._config_changed():
+                self.log.info('The '+self.service_name+' config has not changed, so it will not be restarted.')
+            else:
+                with profiler.Profiler.phase('daemon_stop', service=self.service_name):
+                    self._do_stop(vars(parsed_args)['grace_period'])
+                with profiler.Profiler.phase('daemon_start', service=self.service_name):
+                    self._do_start(vars(parsed_args)['timeout'])
 
 ###
 
 class Coordinator(DaemonCommand):
     "The Coordinator will process existing job orders into requests for VMs and jobs that will be picked up by running VMs."
     log = logging.getLogger(__name__)
-    def __init__(self,Coordinator,args):
+    def __init__(self,app,app_args):
+        super(Coordinator,self).__init__(app,app_args)
         self.service_name='Coordinator'
 
 ###
@@ -105,5 +253,56 @@ class Coordinator(DaemonCommand):
 class Provisioner(DaemonCommand):
     "The Provisioner will launcher worker VMs as needed based on the workflow orders sent to the system."
     log = logging.getLogger(__name__)
-    def __init__(self,Provisioner,args):
+    def __init__(self,app,app_args):
+        super(Provisioner,self).__init__(app,app_args)
         self.service_name='Provisioner'
+        # The Provisioner also reads the youxia config, which has the image and instance type for the workers.
+        self.config_files=[launcher.master_config_path,launcher.youxia_config_path]
+
+###
+
+class Services(cliff.command.Command):
+    "Start, stop or restart the Coordinator and the Provisioner with one command."
+    log = logging.getLogger(__name__)
+    service_commands={'coordinator':Coordinator,'provisioner':Provisioner}
+
+    def get_parser(self,prog_name):
+        parser = super(Services,self).get_parser(prog_name)
+        subparser = parser.add_subparsers(title='subcommands',help='services subcommands: start, stop, restart',dest='service_state')
+        subparser.required=True
+        start_parser = subparser.add_parser('start',help='Start the services')
+        stop_parser = subparser.add_parser('stop',help='Stop the services')
+        restart_parser = subparser.add_parser('restart',help='Stop and then start the services')
+        for p in (start_parser, stop_parser, restart_parser):
+            p.add_argument('--all',dest='all_services',help='Use all of the services: '+', '.join(sorted(self.service_commands)),required=False,action='store_true')
+            p.add_argument('--service',dest='service_names',help='The name of a service to use. Can be given more than once.',required=False,action='append',choices=sorted(self.service_commands))
+        for p in (start_parser, restart_parser):
+            p.add_argument('--timeout',dest='timeout',help='How many seconds to wait for each service to be ready.',required=False,type=float,default=30)
+        for p in (stop_parser, restart_parser):
+            add_stop_arguments(p)
+        return parser
+
+    def _in_parallel(self, phase, action, daemons):
+        "Call action on each of the daemons at the same time and return the results."
+        def timed_action(daemon):
+            with profiler.Profiler.phase(phase, service=daemon.service_name):
+                return action(daemon)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1,len(daemons))) as executor:
+            return list(executor.map(timed_action, daemons))
+
+    def take_action(self, parsed_args):
+        subparser_name=vars(parsed_args)['service_state']
+        service_names=vars(parsed_args)['service_names'] or []
+        if vars(parsed_args)['all_services']:
+            service_names=sorted(self.service_commands)
+        if service_names==[]:
+            self.log.info('Please use --all or --service to choose which services to '+subparser_name+'.')
+            return 1
+        daemons=[self.service_commands[name](self.app,self.app_args) for name in sorted(set(service_names))]
+        if subparser_name in ('stop','restart'):
+            grace_period=vars(parsed_args)['grace_period']
+            self._in_parallel('daemon_stop', lambda daemon: daemon._do_stop(grace_period), daemons)
+        if subparser_name in ('start','restart'):
+            timeout=vars(parsed_args)['timeout']
+            started=self._in_parallel('daemon_start', lambda daemon: daemon._do_start(timeout), daemons)
+            self.log.debug('started: '+str(dict(zip([d.service_name for d in daemons],started))))
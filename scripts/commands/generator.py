@@ -3,174 +3,522 @@ import logging
 import cliff.command
 import configparser
 import workflowlister
+import iniindex
+import queuedb
+import profiler
+import mirror
+import launcher
 import json
+import datetime
+import io
 import os
 import sys
+import shutil
+import tempfile
+from commands.sysconfig import SysConfig
+from commands.daemons import Provisioner
 
 class Generator(cliff.command.Command):
     "This Generator will generate new job orders based on the contents of ~/ini-dir. Be aware that it will also rewrite your params.json file and your ~.youxia/config file."
     log = logging.getLogger(__name__)
+    ini_dir = launcher.ini_dir
+    params_path = launcher.params_path
+    youxia_config_path = launcher.youxia_config_path
+    master_config_path = launcher.master_config_path
+    # Set from --non-interactive: never wait for input, fail instead.
+    non_interactive = False
+    # The exit code when an OpenStack environment can't be chosen without asking.
+    os_env_exit_code = 2
+    _chosen_os_env = None
+
     def get_parser(self,prog_name):
         parser = super(Generator,self).get_parser(prog_name)
-        parser.add_argument('--workflow',dest='workflow_name',help='The name of the workflow for which you would like to generate jobs.',required=True)
+        workflow_group = parser.add_mutually_exclusive_group(required=True)
+        workflow_group.add_argument('--workflow',dest='workflow_name',help='The name of the workflow for which you would like to generate jobs.')
+        workflow_group.add_argument('--batch',dest='batch',help='Generate jobs for several workflows at once. INIs in a subdirectory of ~/ini-dir that is named after a workflow (for example: ~/ini-dir/HelloWorld_1.0-SNAPSHOT/) are for that workflow. INIs at the top of ~/ini-dir are for the workflow named by their --workflow_key key.', action='store_true')
+        parser.add_argument('--workflow_key',dest='workflow_key',help='The INI key that names the workflow of an INI file in --batch mode. Default: pancancer_workflow', required=False, default='pancancer_workflow')
         parser.add_argument('--force',dest='force_generate',help='Force the generation of the jobs, even if the system detects that the job has already been generated once before.', required=False, action='store_true')
         parser.add_argument('--keep_failed',dest='keep_failed',help='Keep failed workers in the fleet. Useful for debugging workflows.', required=False, action='store_true')
-        parser.add_argument('--os_env_name',dest='os_env_name',help='The name of the OpenStack environment you\'re working in. Only useful if you are working in OpenStack. If you omit this, you will be prompted for this information when necessary.', required=False)
+        parser.add_argument('--os_env_name',dest='os_env_name',help='The name of the OpenStack environment you\'re working in. Only useful if you are working in OpenStack. If you omit this, the "os_env_name" setting in ~/.pancancer/simple_pancancer_config.json is used (a name, or a list of names in order of preference), or you will be prompted for this information when necessary.', required=False)
+        parser.add_argument('--non-interactive',dest='non_interactive',help='Never prompt for input. If an OpenStack environment can\'t be chosen, exit with code 2 instead.', required=False, action='store_true')
+        parser.add_argument('--dry-run','--plan',dest='plan',help='Show what would be generated (the number of jobs, the worker image and instance type, how many VMs the fleet will have, how many waves of jobs there will be and how long they might take) without changing anything.', required=False, action='store_true')
+        parser.add_argument('--plan_format',dest='plan_format',help='The format of the --plan output. Default: table', required=False, choices=['table','json'], default='table')
+        parser.add_argument('--job_hours',dest='job_hours',help='For --plan: how many hours one job takes. By default, this is the average of recent successful jobs of the same workflows, if the queue database can be read.', required=False, type=float)
         #parser.add_argument('--no_config_update',dest='no_config_update',help='Do not update any configuration files.', required=False, action='store_true')
         #parser.add_argument('--uses_gnos', dest='use_gnos',help='Indicates that your worfklow will be using GNOS repositories. --use_gnos and --use_s3 are not mutually exclusive - you could configure your workflow\'s INI file to use both GNOS and AWS S3 repositories.',required=False, default=True, choices=[True,False])
         #parser.add_argument('--uses_s3', dest='use_s3',help='Indicates that your worfklow will be using S3 repositories.  --use_gnos and --use_s3 are not mutually exclusive - you could configure your workflow\'s INI file to use both GNOS and AWS S3 repositories.',required=False, default=False, choices=[True,False])
         return parser
 
+    def _run_command(self, command_class, command_name, args):
+        "Run another pancancer command in this process, as if 'pancancer <command_name> <args>' had been called."
+        cmd = command_class(self.app, self.app_args)
+        cmd_args = cmd.get_parser('pancancer '+command_name).parse_args(args)
+        return cmd.take_action(cmd_args)
+
+    def _get_cloud_specific_details(self, workflow_details, cloud_env, os_env_name):
+        "Returns the details (image, instance-type, lvm_devices) of the workflow for the cloud environment that the launcher is running in."
+        if cloud_env == 'AWS' :
+            cloud_specific_details = workflow_details['cloud-specific-details']['aws']
+        elif cloud_env == 'OPENSTACK' : 
+            self.log.debug('OpenStack options: '+str(workflow_details['cloud-specific-details']['openstack']))
+            if len(workflow_details['cloud-specific-details']['openstack'].keys())==0:
+                print('No OpenStack environments are available. Exiting.')
+                sys.exit(1)                  
+            os_env_name = self._select_os_env(list(workflow_details['cloud-specific-details']['openstack'].keys()), os_env_name)
+            cloud_specific_details = workflow_details['cloud-specific-details']['openstack'][os_env_name]
+            
+        elif cloud_env == 'AZURE' : 
+            cloud_specific_details = workflow_details['cloud-specific-details']['azure']
+        else:
+            self.log.error("Unrecognized cloud environment: "+cloud_env)
+            cloud_specific_details = None
+        return cloud_specific_details
+
+    def _read_simple_config(self):
+        if os.path.isfile(workflowlister.WorkflowLister.config_path):
+            with open(workflowlister.WorkflowLister.config_path,'r') as simple_config_file:
+                return json.load(simple_config_file)
+        return {}
+
+    def _select_os_env(self, available, os_env_name):
+        """Chooses one of the available OpenStack environments: the one given with --os_env_name, the first available one from "os_env_name" in the simple config
+        (a name, or a list of names in order of preference), the only one there is, or the one that was chosen for the previous workflow in this run.
+        Otherwise the user is asked, unless --non-interactive was given or there is no terminal to ask on, in which case the command exits with os_env_exit_code."""
+        if self._chosen_os_env in available:
+            return self._chosen_os_env
+        if os_env_name is not None:
+            if os_env_name in available:
+                return os_env_name
+            self.log.error('\''+os_env_name+'\' is not one of the OpenStack environments that are available for this workflow: '+', '.join(sorted(available)))
+            if Generator.non_interactive or not sys.stdin.isatty():
+                sys.exit(Generator.os_env_exit_code)
+        else:
+            preferred = self._read_simple_config().get('os_env_name') or []
+            if isinstance(preferred, str):
+                preferred = [preferred]
+            for k in preferred:
+                if k in available:
+                    self.log.info('Using the OpenStack environment \''+k+'\' from '+workflowlister.WorkflowLister.config_path)
+                    return k
+            # If there is only one OpenStack choice, we'll just go with that.
+            if len(available)==1:
+                return available[0]
+            if Generator.non_interactive or not sys.stdin.isatty():
+                self.log.error('There is more than one OpenStack environment for this workflow ('+', '.join(sorted(available))+'). Choose one with --os_env_name, or set "os_env_name" in '+workflowlister.WorkflowLister.config_path)
+                sys.exit(Generator.os_env_exit_code)
+
+        print('Please enter one of the following OpenStack configurations that are available for this workflow:')
+        for k in available:
+            print(k)
+        try:
+            user_value = input().strip()
+            while user_value.strip() == '' or user_value not in available:
+                print('Sorry, but \''+user_value+'\' was not a valid value. Please try again; valid values are: ')
+                for k in available:
+                    print(k)
+                user_value = input().strip()
+        except EOFError:
+            self.log.error('No OpenStack environment was entered.')
+            sys.exit(Generator.os_env_exit_code)
+        self._chosen_os_env = user_value
+        return user_value
+
+    def _update_master_config(self, force_generate, keep_failed):
+        self.log.debug('setting check_previous_job_hash to false in '+Generator.master_config_path)
+        master_config = configparser.ConfigParser()
+        master_config.optionxform = str
+        # We have to update the master config file so that the generator process will allow duplicates.
+        master_config.read(Generator.master_config_path)
+
+        check_previous_job_hash = str(not force_generate).lower()
+        reap_failed_workers = str(not keep_failed).lower()
+        # The file only needs to be written when one of these settings is different from the last run.
+        if master_config['generator'].get('check_previous_job_hash') == check_previous_job_hash and master_config['provision'].get('reap_failed_workers') == reap_failed_workers:
+            return
+        # if --force then do NOT check previous hash
+        master_config['generator']['check_previous_job_hash']=check_previous_job_hash
+        # keep_failed==true -> reap_failed_workers=false
+        master_config['provision']['reap_failed_workers']=reap_failed_workers
+
+        with open(Generator.master_config_path,'w') as master_config_file:
+            master_config.write(master_config_file,space_around_delimiters=True)
+
+    def _update_params(self, workflows, cloud_specific_details):
+        """Update params.json with the workflow/container info about all of the requested workflows, in one write.
+        workflows is a list of (workflow name, workflow details)."""
+        paramsData=''
+        with open(Generator.params_path,'r') as params_file:
+            old_params = params_file.read()
+        paramsData = json.loads(old_params)
+        # Only the workflows that are being generated should be installed on new workers.
+        for key in ('http_workflows','s3_workflows'):
+            if any(key[:-1] in workflow_details for workflow_name, workflow_details in workflows):
+                paramsData[key] = {}
+        for key in ('containers','s3_containers','http_containers'):
+            if any(key in workflow_details for workflow_name, workflow_details in workflows):
+                paramsData[key] = {}
+        for workflow_name, workflow_details in workflows:
+            if 'http_workflow' in workflow_details:
+                paramsData['http_workflows'][workflow_name] = dict(workflow_details['http_workflow'])
+                paramsData['http_workflows'][workflow_name]['name'] = workflow_details['full_name']
+            if 's3_workflow' in workflow_details:
+                paramsData['s3_workflows'][workflow_name] = dict(workflow_details['s3_workflow'])
+                paramsData['s3_workflows'][workflow_name]['name'] = workflow_details['full_name']
+            # Workflows often use the same containers, so these are merged by container name.
+            for key in ('containers','s3_containers','http_containers'):
+                if key in workflow_details:
+                    paramsData[key].update(workflow_details[key])
+
+        self._use_mirror(paramsData)
+
+        paramsData['lvm_device_whitelist']=cloud_specific_details['lvm_devices']
+        
+        if paramsData['lvm_device_whitelist'] == "" or paramsData['lvm_device_whitelist'].strip() == "":
+            paramsData['single_node_lvm'] = "false"
+        else:
+            paramsData['single_node_lvm'] = "true"
+
+        # if --force then do NOT check previous hash
+        #paramsData['generator']['check_previous_job_hash']=str(not force_generate)
+        # keep_failed==true -> reap_failed_workers=false
+        #paramsData['provision']['reap_failed_workers']=str(not keep_failed)
+        #
+        # In a batch, this is the first workflow; all of them are in http_workflows/s3_workflows.
+        paramsData['workflow_name'] = workflows[0][0]
+
+        # Now write the params.json file, if it has changed (it won't have if the same workflows were generated last time).
+        new_params = str(json.dumps(paramsData,sort_keys=True, indent=4) )
+        if new_params != old_params:
+            with open(Generator.params_path,'w+') as params_file:
+                params_file.write(new_params)
+
+    def _use_mirror(self, paramsData):
+        "If the launcher's mirror is served at \"workflow_mirror_url\" (from the simple config), point the workers at the mirrored copies of the bundles and HTTP containers that have been prefetched."
+        base_url = self._read_simple_config().get('workflow_mirror_url')
+        if not base_url:
+            return
+        store = mirror.Mirror()
+        for key in ('http_workflows','http_containers'):
+            for name, details in paramsData.get(key, {}).items():
+                if 'url' in details:
+                    mirror_url = store.mirror_url(details['url'], base_url)
+                    if mirror_url != details['url']:
+                        self.log.info('Workers will download '+name+' from the mirror: '+mirror_url)
+                        details['url'] = mirror_url
+                    else:
+                        self.log.info(name+' has not been prefetched, workers will download it from '+details['url'])
+
+    def _update_youxia_config(self, cloud_env, cloud_specific_details):
+        "Update the youxia config file with the correct AMI and instance-type"
+        config = configparser.ConfigParser()
+        old_config = ''
+        if os.path.isfile(Generator.youxia_config_path):
+            with open(Generator.youxia_config_path,'r') as youxia_configfile:
+                old_config = youxia_configfile.read()
+        config.read_string(old_config)
+        if cloud_env == 'AWS':
+            config['deployer']['instance_type']=cloud_specific_details['instance-type']
+            config['deployer']['ami_image']=cloud_specific_details['image']
+        elif cloud_env == 'OPENSTACK':
+            config['deployer_openstack']['flavor']=cloud_specific_details['instance-type']
+            config['deployer_openstack']['image_id']=cloud_specific_details['image']
+        elif cloud_env == 'AZURE':
+            config['deployer_azure']['flavor']=cloud_specific_details['instance-type']
+            config['deployer_azure']['image_name']=cloud_specific_details['image']
+
+        # Only write the file if the image or instance type has changed.
+        new_config = io.StringIO()
+        config.write(new_config,space_around_delimiters=True)
+        if new_config.getvalue() != old_config:
+            with open(Generator.youxia_config_path,'w') as youxia_configfile:
+                youxia_configfile.write(new_config.getvalue())
+
+    def _generate_jobs(self, workflow_name, workflow_details, ini_dir):
+        "Run the Java Generator for the INIs in ini_dir. Returns True if it succeeded."
+        workflow_version = ''            
+        if 'http_workflow' in workflow_details:
+            workflow_version = workflow_details['http_workflow']['version']
+        else:
+            workflow_version = workflow_details['s3_workflow']['version']
+        
+        generator_cmd = [launcher.command('Generator'), '--workflow-name', workflow_name, '--workflow-version', workflow_version, '--workflow-path', '/workflows/'+workflow_details['full_name'], '--ini-dir', ini_dir, '--config', Generator.master_config_path]
+        self.log.debug('generator command will be: '+' '.join(generator_cmd))
+        with profiler.Profiler.phase('java_generator', workflow=workflow_name):
+            return_code = subprocess.call(generator_cmd)
+        if return_code != 0:
+            self.log.warn('Attempt to generate jobs for '+workflow_name+' may have encountered an error...')
+            return False
+        self.log.info('Job requests have been generated for the '+workflow_name+' using the INIs in '+ini_dir)
+        return True
+
+    @staticmethod
+    def _read_ini_value(ini_path, key):
+        "Returns the value of key in an INI file (key=value lines), or None."
+        with open(ini_path,'r') as ini_file:
+            for line in ini_file:
+                k, sep, v = line.partition('=')
+                if sep and k.strip() == key:
+                    return v.strip()
+        return None
+
+    def _group_inis(self, workflow_key):
+        """Groups the INIs in the INI directory by workflow. INIs in a subdirectory that is named after a workflow belong to that workflow,
+        INIs at the top of the directory belong to the workflow named by their workflow_key value. Returns a dict of workflow name to INI paths."""
+        workflow_names = workflowlister.WorkflowLister.get_workflow_keys()
+        groups = {}
+        for entry in sorted(os.listdir(Generator.ini_dir)):
+            path = os.path.join(Generator.ini_dir, entry)
+            if os.path.isdir(path):
+                if entry not in workflow_names:
+                    self.log.warn('Skipping '+path+': '+entry+' is not the name of an available workflow.')
+                    continue
+                ini_paths = [os.path.join(path, f) for f in sorted(os.listdir(path)) if os.path.isfile(os.path.join(path, f))]
+            else:
+                entry = Generator._read_ini_value(path, workflow_key)
+                if entry is None:
+                    self.log.warn('Skipping '+path+': it is not in a workflow subdirectory and has no '+workflow_key+' key.')
+                    continue
+                if entry not in workflow_names:
+                    self.log.warn('Skipping '+path+': '+entry+' is not the name of an available workflow.')
+                    continue
+                ini_paths = [path]
+            groups.setdefault(entry, []).extend(ini_paths)
+        return {k: v for k, v in groups.items() if v}
+
+    def _stage_inis(self, workflow_name, ini_paths):
+        "Returns a directory that contains only ini_paths, so that it can be given to the Java Generator. The caller must remove it."
+        # Hard links in a directory on the same filesystem are as good as a copy, without the copying.
+        staging_dir = tempfile.mkdtemp(prefix='.'+workflow_name+'_', dir=os.path.dirname(Generator.ini_dir))
+        for ini_path in ini_paths:
+            staged_path = os.path.join(staging_dir, os.path.basename(ini_path))
+            try:
+                os.link(ini_path, staged_path)
+            except OSError:
+                shutil.copy2(ini_path, staged_path)
+        return staging_dir
+
+    def _configure_system(self):
+        # Run sysconfig in this process rather than starting a new pancancer process. It will not regenerate the config files if nothing has changed.
+        try:
+            with profiler.Profiler.phase('sysconfig'):
+                self._run_command(SysConfig, 'sysconfig', [])
+        except Exception as e:
+            self.log.warn('Attempt to (re)configure system may have encountered an error: '+str(e))
+
+    def _restart_provisioner(self):
+        # The provisioner only needs to be restarted if the config it was started with has changed.
+        try:
+            with profiler.Profiler.phase('provisioner_restart'):
+                self._run_command(Provisioner, 'provisioner', ['restart', '--if-changed'])
+        except Exception as e:
+            self.log.warn('Attempt to restart the provisioner may have encountered an error: '+str(e))
+
+    def _check_inis(self, workflow_name, workflow_details, ini_paths, index, force_generate, workflow_key):
+        """Reads every INI file, checks that it is well formed and has all of the keys in the workflow's default INI, and that jobs have not already been generated for it
+        or for an identical INI earlier in ini_paths. Returns a list of (path, hash) of the INIs to generate jobs for, and a list of (path, reason) of the ones that were skipped."""
+        required_keys = None
+        # Like 'workflows config', HelloWorld has no default INI to check against.
+        if 'HelloWorld' not in workflow_name and 'default-ini' in workflow_details:
+            required_keys = index.required_keys(workflow_details['default-ini'])
+        checked = []
+        skipped = []
+        # The first path that each hash was seen at, so that only one job is generated for INIs that are identical apart from formatting.
+        seen = {}
+        for ini_path in ini_paths:
+            try:
+                with open(ini_path,'rb') as ini_file:
+                    ini = iniindex.INIIndex.parse_ini(ini_file.read())
+            except (OSError, ValueError) as e:
+                skipped.append((ini_path, 'malformed: '+str(e)))
+                continue
+            missing_keys = required_keys - ini.keys() if required_keys is not None else None
+            if missing_keys:
+                skipped.append((ini_path, 'missing keys: '+', '.join(sorted(missing_keys))))
+                continue
+            ini_hash = iniindex.INIIndex.canonical_hash(workflow_name, ini, ignore_keys=(workflow_key,))
+            if ini_hash in seen:
+                skipped.append((ini_path, 'duplicate of '+seen[ini_hash]))
+                continue
+            seen[ini_hash] = ini_path
+            checked.append((ini_path, ini_hash))
+        if force_generate:
+            return checked, skipped
+        submitted = index.find_submitted(h for p, h in checked)
+        accepted = []
+        for ini_path, ini_hash in checked:
+            if ini_hash in submitted:
+                skipped.append((ini_path, 'jobs have already been generated for this INI (use --force to generate them again)'))
+            else:
+                accepted.append((ini_path, ini_hash))
+        return accepted, skipped
+
+    def _ini_dir_for(self, workflow_name, ini_paths):
+        "Returns the directory to give to the Java Generator for ini_paths, and whether it is a staging directory that has to be removed afterwards."
+        ini_dirs = set(os.path.dirname(p) for p in ini_paths)
+        if len(ini_dirs) == 1:
+            ini_dir = ini_dirs.pop()
+            if set(ini_paths) == set(os.path.join(ini_dir, f) for f in os.listdir(ini_dir) if os.path.isfile(os.path.join(ini_dir, f))):
+                return ini_dir, False
+        return self._stage_inis(workflow_name, ini_paths), True
+
+    def _check_groups(self, groups, index, force_generate, workflow_key):
+        "Checks the INIs of every group. Returns a dict of workflow name to the (path, hash) of the accepted INIs, and a dict of workflow name to the number of skipped INIs."
+        accepted = {}
+        skipped_counts = {}
+        for workflow_name, ini_paths in sorted(groups.items()):
+            workflow_details = workflowlister.WorkflowLister.get_workflow_details(workflow_name)
+            accepted[workflow_name], skipped = self._check_inis(workflow_name, workflow_details, ini_paths, index, force_generate, workflow_key)
+            for ini_path, reason in skipped:
+                self.log.warn('Skipping '+ini_path+': '+reason)
+            skipped_counts[workflow_name] = len(skipped)
+            self.log.info(workflow_name+': '+str(len(ini_paths))+' INI files, '+str(len(skipped))+' skipped')
+        return accepted, skipped_counts
+
+    def _get_fleet_details(self, workflows, cloud_env, os_env_name):
+        "Returns the cloud-specific details that the workers for all of workflows will be launched with, or None if there are none."
+        # All workers in the fleet are launched from the same image, so every workflow in a batch has to be able to run on it.
+        cloud_specific_details = None
+        for workflow_name, workflow_details in workflows:
+            details = self._get_cloud_specific_details(workflow_details, cloud_env, os_env_name)
+            if details is None:
+                return None
+            if cloud_specific_details is None:
+                cloud_specific_details = details
+            elif details != cloud_specific_details:
+                self.log.error(workflow_name+' needs a different image, instance type or LVM devices ('+str(details)+') than '+workflows[0][0]+' ('+str(cloud_specific_details)+'), so they cannot be generated in the same batch.')
+                return None
+        return cloud_specific_details
+
+    def _do_generate(self, groups, workflow_key, force_generate, keep_failed, os_env_name, cloud_env):
+        "Generate jobs for groups, a dict of workflow name to INI paths. The system is only configured once, however many workflows there are."
+        # Check the INIs before anything else, so that bad or duplicate INIs are found before the system is reconfigured.
+        index = iniindex.INIIndex()
+        try:
+            with profiler.Profiler.phase('ini_check'):
+                accepted, skipped_counts = self._check_groups(groups, index, force_generate, workflow_key)
+            accepted = {k: v for k, v in accepted.items() if v}
+            if not accepted:
+                self.log.info('There are no INI files to generate jobs for.')
+                return
+
+            workflows = [(workflow_name, workflowlister.WorkflowLister.get_workflow_details(workflow_name)) for workflow_name in sorted(accepted)]
+            cloud_specific_details = self._get_fleet_details(workflows, cloud_env, os_env_name)
+            if cloud_specific_details is None:
+                return 1
+
+            self._configure_system()
+            with profiler.Profiler.phase('config_update'):
+                self._update_master_config(force_generate, keep_failed)
+                # Before generating the jobs, we have to update params.json with the workflow/container info about the requested workflows.
+                self._update_params(workflows, cloud_specific_details)
+                self._update_youxia_config(cloud_env, cloud_specific_details)
+            self._restart_provisioner()
+
+            failed = []
+            for workflow_name, workflow_details in workflows:
+                ini_dir, staged = self._ini_dir_for(workflow_name, [p for p, h in accepted[workflow_name]])
+                try:
+                    if self._generate_jobs(workflow_name, workflow_details, ini_dir):
+                        index.add(workflow_name, accepted[workflow_name])
+                    else:
+                        failed.append(workflow_name)
+                finally:
+                    if staged:
+                        shutil.rmtree(ini_dir, ignore_errors=True)
+            if failed:
+                self.log.warn('Job generation may have failed for: '+', '.join(failed))
+        finally:
+            index.close()
+
+    def _recent_job_hours(self, workflow_names):
+        "The average number of hours that recent successful jobs of these workflows took, or None if it is not known."
+        try:
+            durations = []
+            for workflow_name in workflow_names:
+                columns, rows = queuedb.QueueDB.query("select create_timestamp, update_timestamp from job where status = 'SUCCESS' and workflow = %s order by job_id desc limit 100", (workflow_name,))
+                for created, updated in rows:
+                    if isinstance(created, str):
+                        created, updated = datetime.datetime.fromisoformat(created), datetime.datetime.fromisoformat(updated)
+                    durations.append((updated - created).total_seconds() / 3600)
+        except Exception as e:
+            self.log.debug('Could not read the durations of previous jobs: '+str(e))
+            return None
+        if not durations:
+            return None
+        return sum(durations) / len(durations)
+
+    def _do_plan(self, groups, workflow_key, force_generate, os_env_name, cloud_env, job_hours=None):
+        "Works out what generating jobs for groups would do, without changing any file, the queue or the daemons. Returns the plan as a dict."
+        index = iniindex.INIIndex(read_only=True)
+        try:
+            accepted, skipped_counts = self._check_groups(groups, index, force_generate, workflow_key)
+        finally:
+            index.close()
+        workflows = [(workflow_name, workflowlister.WorkflowLister.get_workflow_details(workflow_name)) for workflow_name in sorted(groups)]
+        cloud_specific_details = self._get_fleet_details([w for w in workflows if accepted[w[0]]] or workflows, cloud_env, os_env_name)
+        max_fleet_size = int(self._read_simple_config().get('max_fleet_size', 0))
+
+        num_jobs = sum(len(v) for v in accepted.values())
+        # Each worker VM runs one job at a time, so jobs run in waves of up to max_fleet_size.
+        vms = min(max_fleet_size, num_jobs)
+        waves = -(-num_jobs // max_fleet_size) if max_fleet_size > 0 else None
+        if job_hours is None:
+            job_hours = self._recent_job_hours(sorted(groups))
+        plan = {'cloud_env': cloud_env,
+                'workflows': [{'workflow': workflow_name,
+                               'version': workflow_details['http_workflow']['version'] if 'http_workflow' in workflow_details else workflow_details['s3_workflow']['version'],
+                               'inis': len(groups[workflow_name]),
+                               'skipped': skipped_counts[workflow_name],
+                               'jobs': len(accepted[workflow_name])} for workflow_name, workflow_details in workflows],
+                'image': cloud_specific_details['image'] if cloud_specific_details else None,
+                'instance_type': cloud_specific_details['instance-type'] if cloud_specific_details else None,
+                'lvm_devices': cloud_specific_details['lvm_devices'] if cloud_specific_details else None,
+                'jobs': num_jobs,
+                'max_fleet_size': max_fleet_size,
+                'vms': vms,
+                'waves': waves,
+                'job_hours': round(job_hours, 2) if job_hours is not None else None,
+                'jobs_per_hour': round(vms / job_hours, 2) if job_hours and vms else None,
+                'estimated_hours': round(waves * job_hours, 2) if job_hours is not None and waves is not None else None}
+        return plan
+
+    def _print_plan(self, plan, plan_format):
+        if plan_format == 'json':
+            self.app.stdout.write(json.dumps(plan, sort_keys=True, indent=4)+'\n')
+            return
+        queuedb.print_table(self.app.stdout, ['workflow', 'version', 'inis', 'skipped', 'jobs'], [[w[k] for k in ('workflow', 'version', 'inis', 'skipped', 'jobs')] for w in plan['workflows']])
+        self.app.stdout.write('\n')
+        queuedb.print_table(self.app.stdout, ['setting', 'value'], [[k, plan[k]] for k in ('cloud_env', 'image', 'instance_type', 'lvm_devices', 'jobs', 'max_fleet_size', 'vms', 'waves', 'job_hours', 'jobs_per_hour', 'estimated_hours')])
+
     def take_action(self, parsed_args):
         workflow_name = vars(parsed_args)['workflow_name']
         force_generate = vars(parsed_args)['force_generate']
         keep_failed = vars(parsed_args)['keep_failed']
         os_env_name = vars(parsed_args)['os_env_name']
+        workflow_key = vars(parsed_args)['workflow_key']
         self.log.debug('workflow_name: %s',workflow_name)
         self.log.debug('all workflows: '+workflowlister.WorkflowLister.get_workflow_names())
         cloud_env = os.environ['HOST_ENV'].upper()
-        
-        if workflow_name in workflowlister.WorkflowLister.get_workflow_keys():
+        Generator.non_interactive = vars(parsed_args)['non_interactive']
 
+        if vars(parsed_args)['batch']:
+            groups = self._group_inis(workflow_key)
+            if not groups:
+                self.log.info(Generator.ini_dir+' has no INI files for any available workflow. Place your INI files in subdirectories named after their workflows, or give each INI a '+workflow_key+' key.')
+                return
+        elif workflow_name in workflowlister.WorkflowLister.get_workflow_keys():
             # First thing: if the directory is empty, don't bother going any further.
-            if os.listdir(path='/home/ubuntu/ini-dir') != []:
-            
-                sysconfig_cmd = 'pancancer sysconfig'
-                return_code = subprocess.call(sysconfig_cmd.split(' '))
-                if return_code != 0:
-                    self.log.warn('Attempt to (re)configure system may have encountered an error...')
-    
-    
-                master_config_path = os.path.expanduser('~/arch3/config/masterConfig.ini')
-                self.log.debug('setting check_previous_job_hash to false in '+master_config_path)
-                master_config = configparser.ConfigParser()
-                master_config.optionxform = str
-                # We have to update the master config file so that the generator process will allow duplicates.
-                master_config.read(master_config_path)
-     
-                # if --force then do NOT check previous hash
-                master_config['generator']['check_previous_job_hash']=str(not force_generate).lower()
-                # keep_failed==true -> reap_failed_workers=false
-                master_config['provision']['reap_failed_workers']=str(not keep_failed).lower()
-    
-                with open(master_config_path,'w') as master_config_file:
-                    master_config.write(master_config_file,space_around_delimiters=True)
-    
-                workflow_details = workflowlister.WorkflowLister.get_workflow_details(workflow_name)
-                
-                if cloud_env == 'AWS' :
-                    cloud_specific_details = workflow_details['cloud-specific-details']['aws']
-                elif cloud_env == 'OPENSTACK' : 
-                    # If there is only one OpenStack choice, we'll just go with that.
-                    self.log.debug('OpenStack options: '+str(workflow_details['cloud-specific-details']['openstack']))
-                    if len(workflow_details['cloud-specific-details']['openstack'].keys())==0:
-                        print('No OpenStack environments are available. Exiting.')
-                        sys.exit(1)                  
-                    elif len(workflow_details['cloud-specific-details']['openstack'].keys())==1:
-                        k = list(workflow_details['cloud-specific-details']['openstack'].keys())[0]
-                        cloud_specific_details = workflow_details['cloud-specific-details']['openstack'][k]
-                    else:
-                        # Check to see if the user did not provide an OpenStack environment name, or if it's not in the list of *actual* names
-                        if os_env_name is None or os_env_name not in workflow_details['cloud-specific-details']['openstack']:
-                            print('Please enter one of the following OpenStack configurations that are available for this workflow:')
-                            for k in workflow_details['cloud-specific-details']['openstack']:
-                                print(k)
-                            user_value = input().strip()
-                            while user_value.strip() == '' or user_value not in workflow_details['cloud-specific-details']['openstack']:
-                                print('Sorry, but \''+user_value+'\' was not a valid value. Please try again; valid values are: ')
-                                for k in workflow_details['cloud-specific-details']['openstack']:
-                                    print(k)
-                                user_value = input().strip()
-                            cloud_specific_details = workflow_details['cloud-specific-details']['openstack'][user_value]
-                        else:
-                            # If the user provided an OpenStack environment name and it's legit, just use it.
-                            cloud_specific_details = workflow_details['cloud-specific-details']['openstack'][os_env_name]
-                    
-                elif cloud_env == 'AZURE' : 
-                    cloud_specific_details = workflow_details['cloud-specific-details']['azure']
-                else:
-                    self.log.error("Unrecognized cloud environment: "+cloud_env)
-
-                workflow_version = ''            
-                if 'http_workflow' in workflow_details:
-                    workflow_version = workflow_details['http_workflow']['version']
-                else:
-                    workflow_version = workflow_details['s3_workflow']['version']
-                
-                generator_cmd = 'Generator --workflow-name '+workflow_name+' --workflow-version '+workflow_version+' --workflow-path '+'/workflows/'+workflow_details['full_name']+' --ini-dir '+'/home/ubuntu/ini-dir --config /home/ubuntu/arch3/config/masterConfig.ini'
-                self.log.debug('generator command will be: '+generator_cmd)
-                # Before generating the job, we have to update params.json with the workflow/container info about the requested workflow.
-                paramsData=''
-                with open('/home/ubuntu/params.json','r') as params_file:
-                    paramsData = json.load(params_file)
-                    if 'http_workflow' in workflow_details:
-                        paramsData['http_workflows'] = {}
-                        paramsData['http_workflows'][workflow_name] = workflow_details['http_workflow']
-                        paramsData['http_workflows'][workflow_name]['name'] = workflow_details['full_name']
-                    if 's3_workflow' in workflow_details:
-                        paramsData['s3_workflows'] = {}
-                        paramsData['s3_workflows'][workflow_name] = workflow_details['s3_workflows']
-                        paramsData['s3_workflows'][workflow_name]['name'] = workflow_details['full_name']
-                    if 'containers' in workflow_details:
-                        paramsData['containers'] = workflow_details['containers']
-                    if 's3_containers' in workflow_details:
-                        paramsData['s3_containers'] = workflow_details['s3_containers']
-                    if 'http_containers' in workflow_details:
-                        paramsData['http_containers'] = workflow_details['http_containers']
-                    
-                    paramsData['lvm_device_whitelist']=cloud_specific_details['lvm_devices']
-                    
-                    if paramsData['lvm_device_whitelist'] == "" or paramsData['lvm_device_whitelist'].strip() == "":
-                        paramsData['single_node_lvm'] = "false"
-                    else:
-                        paramsData['single_node_lvm'] = "true"
-    
-                    # if --force then do NOT check previous hash
-                    #paramsData['generator']['check_previous_job_hash']=str(not force_generate)
-                    # keep_failed==true -> reap_failed_workers=false
-                    #paramsData['provision']['reap_failed_workers']=str(not keep_failed)
-                    #
-                    paramsData['workflow_name'] = workflow_name
-    
-                # Now write the params.json file.
-                with open('/home/ubuntu/params.json','w+') as params_file:
-                    params_file.write(str(json.dumps(paramsData,sort_keys=True, indent=4) ))
-    
-                # Update the youxia config file with the correct AMI and instance-type
-                config = configparser.ConfigParser()
-                config.read('/home/ubuntu/.youxia/config')
-                if cloud_env == 'AWS':
-                    config['deployer']['instance_type']=cloud_specific_details['instance-type']
-                    config['deployer']['ami_image']=cloud_specific_details['image']
-                elif cloud_env == 'OPENSTACK':
-                    config['deployer_openstack']['flavor']=cloud_specific_details['instance-type']
-                    config['deployer_openstack']['image_id']=cloud_specific_details['image']
-                elif cloud_env == 'AZURE':
-                    config['deployer_azure']['flavor']=cloud_specific_details['instance-type']
-                    config['deployer_azure']['image_name']=cloud_specific_details['image']
-                    
-                with open('/home/ubuntu/.youxia/config','w') as youxia_configfile:
-                    config.write(youxia_configfile,space_around_delimiters=True)
-    
-               
-                provisioner_cmd = 'pancancer provisioner restart'
-                return_code = subprocess.call(provisioner_cmd.split(' '))
-                if return_code != 0:
-                    self.log.warn('Attempt to restart the provisioner may have encountered an error...')
-    
-                #sysconfig = SysConfig(SysConfig)
-                #parsed_args = sysconfig.get_parser('SysConfig').parse_args('')
-                #sysconfig.run()
-                #provisioner = Provisioner()
-                #provisioner.run(self, provisioner_cmd.split(' '))
-                
-                return_code = subprocess.call(generator_cmd.split(' '))
-                if return_code != 0:
-                    self.log.warn('Attempt to generate jobs may have encountered an error...')
-                else:
-                    self.log.info('Job requests have been generated for the '+workflow_name+' using the INIs in ~/ini-dir')
-            else:
-                self.log.info('/home/ubuntu/ini-dir is empty. Place your INI files here before attempting to run the generator.')
+            ini_paths = [os.path.join(Generator.ini_dir, f) for f in sorted(os.listdir(path=Generator.ini_dir)) if os.path.isfile(os.path.join(Generator.ini_dir, f))]
+            if ini_paths == []:
+                self.log.info(Generator.ini_dir+' is empty. Place your INI files here before attempting to run the generator.')
+                return
+            groups = {workflow_name: ini_paths}
         else:
             self.log.info(workflow_name+' is not the name of an available workflow.\nPlease use the command \'workflows list\' to see the list of currently available workflows.')   
-            
+            return
+
+        if vars(parsed_args)['plan']:
+            plan = self._do_plan(groups, workflow_key, force_generate, os_env_name, cloud_env, vars(parsed_args)['job_hours'])
+            self._print_plan(plan, vars(parsed_args)['plan_format'])
+            return
+        return self._do_generate(groups, workflow_key, force_generate, keep_failed, os_env_name, cloud_env)
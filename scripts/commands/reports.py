@@ -1,28 +1,103 @@
 import cliff.command
+import argparse
 import subprocess
 import logging
+import configparser
+import json
+import os
+import time
+import queuedb
+import profiler
+import launcher
+import atomicfile
 
 class Reports(cliff.command.Command):
     "This will generate reports on the command line."
     log = logging.getLogger(__name__)
+    # These reports are generated here, from the queue_status database and masterConfig.ini. The others are passed on to the Java ReportCLI.
+    native_reports = ('gather', 'jobs', 'provisioned', 'status')
+    cache_dir = os.path.join(launcher.pancancer_dir,'report_cache')
+    master_config_path = launcher.master_config_path
+
     def get_parser(self,prog_name):
         parser = super(Reports,self).get_parser(prog_name)
+        # The options are given after the report's name (for example: pancancer reports jobs --max-age 0), so every report's parser has them.
+        report_options = argparse.ArgumentParser(add_help=False)
+        report_options.add_argument('--max-age',dest='max_age',help='Reuse a report that was generated less than this many seconds ago (default: 10). Use 0 to always generate a new report.',required=False,type=float,default=10)
+        report_options.add_argument('--java',dest='use_java',help='Use the Java ReportCLI for all reports.',required=False,action='store_true')
         subparser = parser.add_subparsers(title='subcommands',help='reporting subcommands: gather, info, jobs, provisioned, status, help',dest='report_subcmd')
         subparser.required=True
-        subparser.add_parser('gather',help='gathers the last message sent by each worker and displays the last line of it')
-        subparser.add_parser('info',help='retrieves detailed information on provisioned instances')
-        subparser.add_parser('jobs',help='retrieves detailed information on jobs')
-        subparser.add_parser('provisioned',help='retrieves detailed information on provisioned instances')
-        subparser.add_parser('status',help='retrieves configuration and version information on arch3')
-        subparser.add_parser('youxia',help='ask youxia for all information on instances known to the cloud APIs that are configured')
-        subparser.add_parser('help',help='Prints a help message for the reporting system.')
+        subparser.add_parser('gather',help='gathers the last message sent by each worker and displays the last line of it',parents=[report_options])
+        subparser.add_parser('info',help='retrieves detailed information on provisioned instances',parents=[report_options])
+        subparser.add_parser('jobs',help='retrieves detailed information on jobs',parents=[report_options])
+        subparser.add_parser('provisioned',help='retrieves detailed information on provisioned instances',parents=[report_options])
+        subparser.add_parser('status',help='retrieves configuration and version information on arch3',parents=[report_options])
+        subparser.add_parser('youxia',help='ask youxia for all information on instances known to the cloud APIs that are configured',parents=[report_options])
+        subparser.add_parser('help',help='Prints a help message for the reporting system.',parents=[report_options])
         return parser
 
+    def _report_gather(self):
+        "The last line that each running worker has sent back."
+        columns, rows = queuedb.QueueDB.query("select job_uuid, workflow, update_timestamp, stdout from job where status = 'RUNNING' order by job_id asc")
+        report_rows = []
+        for job_uuid, workflow, update_timestamp, stdout in rows:
+            lines = (stdout or '').strip().splitlines()
+            report_rows.append((job_uuid, workflow, update_timestamp, lines[-1] if lines else ''))
+        return ['job_uuid', 'workflow', 'update_timestamp', 'last_message'], report_rows
+
+    def _report_jobs(self):
+        "The number of jobs for each workflow and status."
+        return queuedb.QueueDB.query('select workflow, status, count(*) as jobs, min(create_timestamp) as first_created, max(update_timestamp) as last_updated from job group by workflow, status order by workflow, status')
+
+    def _report_provisioned(self):
+        "The worker VMs that are currently provisioned."
+        return queuedb.QueueDB.query("select provision_id, provision_uuid, status, ip_address, job_uuid, create_timestamp, update_timestamp from provision where status in ('START', 'PENDING', 'RUNNING') order by provision_id asc")
+
+    def _report_status(self):
+        "The arch3 settings from masterConfig.ini (without passwords), and the number of jobs and provisioned VMs."
+        master_config = configparser.ConfigParser()
+        master_config.optionxform = str
+        master_config.read(self.master_config_path)
+        rows = []
+        for section in master_config.sections():
+            for k, v in master_config[section].items():
+                if 'pass' not in k.lower():
+                    rows.append((section+'.'+k, v))
+        for table in ('job', 'provision'):
+            columns, counts = queuedb.QueueDB.query('select status, count(*) from '+table+' group by status order by status')
+            for status, count in counts:
+                rows.append((table+'s.'+status, count))
+        return ['setting', 'value'], rows
+
+    def _get_report(self, subcmd, max_age):
+        "Returns (columns, rows) for a report, from the cache if it is recent enough."
+        cache_path = os.path.join(self.cache_dir, subcmd+'.json')
+        if max_age > 0 and os.path.isfile(cache_path) and time.time() - os.path.getmtime(cache_path) < max_age:
+            with open(cache_path) as cache_file:
+                try:
+                    cached = json.load(cache_file)
+                    self.log.debug('using cached report from '+cache_path)
+                    return cached['columns'], cached['rows']
+                except ValueError:
+                    pass
+        columns, rows = getattr(self, '_report_'+subcmd)()
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Timestamps are stored as strings, which is also how they are printed.
+        atomicfile.write(cache_path, json.dumps({'columns':list(columns), 'rows':[list(r) for r in rows]}, default=str))
+        return columns, rows
+
     def take_action(self, parsed_args):
         subcmd = vars(parsed_args)['report_subcmd']
-        cmd_str='java -cp reporting.jar info.pancancer.arch3.reportcli.ReportCLI --config /home/ubuntu/arch3/config/masterConfig.ini'
+        if subcmd in self.native_reports and not vars(parsed_args)['use_java']:
+            columns, rows = self._get_report(subcmd, vars(parsed_args)['max_age'])
+            queuedb.print_table(self.app.stdout, columns, rows)
+            return
+
+        cmd=[launcher.command('java'),'-cp','reporting.jar','info.pancancer.arch3.reportcli.ReportCLI','--config',self.master_config_path]
         if subcmd!='help':
             # If you don't pass a reporting subcommand to ReportCLI, it will print the help text by default.
-            cmd_str='java -cp reporting.jar info.pancancer.arch3.reportcli.ReportCLI --config /home/ubuntu/arch3/config/masterConfig.ini '+subcmd
+            cmd.append(subcmd)
 
-        subprocess.call(cmd_str.split(' '))
+        with profiler.Profiler.phase('java_reports', report=subcmd):
+            subprocess.call(cmd)
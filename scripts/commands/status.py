@@ -1,40 +1,68 @@
 import cliff.command
+import cliff.lister
+import cliff.formatters.base
+import stevedore.extension
+import json
 import subprocess
 import logging
+import os
+import io
+import time
+import tarfile
+import queuedb
+import rabbitmq
+import profiler
+import launcher
+import psutil
+import datetime
 
 class Status(cliff.command.Command):
     "This will return status information about the launcher."
     log = logging.getLogger(__name__)
 
-    def _get_job_results(self, job_id, results_type, out_path):
-        "Gets the stdout/stderr for a job and writes it to a file."
-        cmd = 'psql -U queue_user queue_status -c'
-        sql = 'select '+results_type+' from job where job_id = '+job_id;
-        cmd = cmd.split(' ')
-        cmd.append(sql)
-        file_name = out_path+'job_'+job_id+'.'+results_type
-        cmd.append('-o')
-        cmd.append(file_name)
-        self.log.debug(cmd)
-        subprocess.call(cmd)
-        self.log.info('Job results ('+results_type+') have been written to '+file_name)
-
-    def _do_sql_status(self, sql):
-        "Executes a command against the postgres database"
-        cmd = 'psql -U queue_user queue_status -c'
-        self.log.debug(cmd)
-        sql_cmd = cmd.split(' ')
-        sql_cmd.append(sql)
-        self.log.debug(sql_cmd)
-        subprocess.call(sql_cmd)
+    def _get_job_results(self, conditions, params, results_types, out_path, tar_path=None, batch_size=100):
+        """Gets the stdout/stderr for every job that matches the conditions and writes them to files in out_path, or to a compressed tar file at tar_path.
+        Rows are read from the database batch_size at a time and each one is written out before the next is read. Returns the number of jobs."""
+        # results_types are restricted to stdout/stderr by the parser, so they are safe to use as column names.
+        sql = 'select job_id, '+', '.join(results_types)+' from job where '+' and '.join(conditions)+' order by job_id asc'
+        columns, rows = queuedb.QueueDB.stream(sql, tuple(params), batch_size)
+        tar_file = tarfile.open(tar_path,'w:gz') if tar_path is not None else None
+        num_jobs = 0
+        try:
+            for row in rows:
+                job_id = str(row[0])
+                for results_type, results in zip(results_types, row[1:]):
+                    file_name = 'job_'+job_id+'.'+results_type
+                    if tar_file is not None:
+                        data = (results or '').encode('utf-8')
+                        tar_info = tarfile.TarInfo(file_name)
+                        tar_info.size = len(data)
+                        tar_info.mtime = time.time()
+                        tar_file.addfile(tar_info, io.BytesIO(data))
+                    else:
+                        file_name = os.path.join(out_path,file_name)
+                        with open(file_name,'w') as results_file:
+                            results_file.write(results or '')
+                        self.log.debug('Job results ('+results_type+') have been written to '+file_name)
+                num_jobs += 1
+        finally:
+            if tar_file is not None:
+                tar_file.close()
+        return num_jobs
+
+    def _do_sql_status(self, sql, params=()):
+        "Executes a query against the postgres database and prints the results."
+        columns, rows = queuedb.QueueDB.query(sql, params)
+        queuedb.print_table(self.app.stdout, columns, rows)
 
     def _check_service_with_name(self, service_name):
         "Uses pgrep to check if a process matches the pattern 'java.*<service_name>'"
         # Use pgrep to check if the java process is running.
-        cmd = 'pgrep -fla java.*'+service_name
+        cmd = [launcher.command('pgrep'),'-fla','java.*'+service_name]
         output=''
         try:
-            output = subprocess.check_output(cmd.split(' '),universal_newlines=True)
+            with profiler.Profiler.phase('pgrep', service=service_name):
+                output = subprocess.check_output(cmd,universal_newlines=True)
         except subprocess.CalledProcessError as e:
             # If pgrep returns nothing, then the process is not running.
             self.log.info ('The '+service_name+' process does not appear to be running.')
@@ -43,6 +71,81 @@ class Status(cliff.command.Command):
             # Print the message with the PID
             self.log.info ('The '+service_name+' appears to be running with PID: '+(output.split(' '))[0])
 
+    def _find_service_pid(self, service_name):
+        "Returns the PID of the java process for service_name, or None if it is not running. Uses psutil rather than starting pgrep."
+        for p in psutil.process_iter(['pid','cmdline']):
+            cmdline = p.info['cmdline'] or []
+            if cmdline and os.path.basename(cmdline[0]) == 'java' and any(service_name in arg for arg in cmdline[1:]):
+                return p.info['pid']
+        return None
+
+    def _do_watch(self, interval, count):
+        """Prints job counts, queue depths and service status every interval seconds, count times (or until interrupted if count is None).
+        After the first refresh, only the jobs that have been updated since the previous refresh are read from the database."""
+        rabbit_api = rabbitmq.RabbitMQAPI()
+        job_statuses = {}
+        counts = {}
+        last_update = None
+        prev_time = None
+        prev_messages = None
+        tick = 0
+        try:
+            while count is None or tick < count:
+                if tick > 0:
+                    time.sleep(interval)
+                now = time.time()
+                completed = 0
+                if last_update is None:
+                    columns, rows = queuedb.QueueDB.stream('select job_id, status, update_timestamp from job')
+                else:
+                    # >= so that rows committed with the same timestamp as the last one we saw are not missed. Rows that have not changed status are ignored.
+                    columns, rows = queuedb.QueueDB.stream('select job_id, status, update_timestamp from job where update_timestamp >= %s', (last_update,))
+                for job_id, status, update_timestamp in rows:
+                    old_status = job_statuses.get(job_id)
+                    if old_status != status:
+                        if old_status is not None:
+                            counts[old_status] -= 1
+                        counts[status] = counts.get(status,0) + 1
+                        job_statuses[job_id] = status
+                        if status == 'SUCCESS' and prev_time is not None:
+                            completed += 1
+                    if update_timestamp is not None and (last_update is None or update_timestamp > last_update):
+                        last_update = update_timestamp
+
+                try:
+                    queues = rabbit_api.list_queues()
+                except (OSError, RuntimeError, ValueError) as e:
+                    self.log.debug('could not get queues: '+str(e))
+                    queues = None
+
+                out = self.app.stdout
+                out.write('\n=== '+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+' ===\n')
+                out.write('Jobs: '+(', '.join(k+': '+str(v) for k, v in sorted(counts.items()) if v) or 'none')+'\n')
+                if queues is None:
+                    out.write('Queues: the RabbitMQ management API is not available\n')
+                else:
+                    messages = sum(q.get('messages',0) for q in queues)
+                    out.write('Queues: '+(', '.join(q['name']+': '+str(q.get('messages',0)) for q in queues) or 'none')+'\n')
+                if prev_time is not None:
+                    minutes = (now - prev_time) / 60
+                    rates = 'Rates: '+'{:.1f}'.format(completed / minutes)+' jobs/min completed'
+                    if queues is not None and prev_messages is not None:
+                        rates += ', '+'{:.1f}'.format((prev_messages - messages) / minutes)+' messages/min drained'
+                    out.write(rates+'\n')
+                services = []
+                for service_name in ('Coordinator','Provisioner'):
+                    pid = self._find_service_pid(service_name)
+                    services.append(service_name+': '+('running (PID '+str(pid)+')' if pid is not None else 'not running'))
+                out.write('Services: '+', '.join(services)+'\n')
+                out.flush()
+                prev_time = now
+                prev_messages = messages if queues is not None else None
+                tick += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            rabbit_api.close()
+
     def _do_service_checks(self):
         "Check the Coordinator and Provisioner."
         self._check_service_with_name('Coordinator')
@@ -50,41 +153,174 @@ class Status(cliff.command.Command):
 
     def get_parser(self,prog_name):
         parser = super(Status,self).get_parser(prog_name)
-        subparser = parser.add_subparsers(title='subcommands',help='status subcommands: queues, jobs, job_status',dest='status_subcmd')
+        subparser = parser.add_subparsers(title='subcommands',help='status subcommands: job_status',dest='status_subcmd')
         subparser.required=True
-        subparser.add_parser('queues',help='Prints some basic status information on the RabbitMQ message queues.')
         subparser.add_parser('job_status',help='Prints counts of jobs by status.')
-        subparser.add_parser('jobs',help='Prints data from the job table (omits standard error and standard out).')
         subparser.add_parser('services',help='Prints the status of the coordinator and provisioner')
-        job_results_parser = subparser.add_parser('job_results', help='Writes the stdout or stderr for a given job id to a file.')
-        job_results_parser.add_argument('--type',help='Can be stderr or stdout', required=True, dest='results_type', choices=['stderr','stdout'])
-        job_results_parser.add_argument('--job_id',help='The ID of the job', required=True, dest='job_id')
-        job_results_parser.add_argument('--out_path',help='The path to the directory where you want the results file to be written to.', required=False,dest='out_path', default='/home/ubuntu/arch3/')
+        watch_parser = subparser.add_parser('watch',help='Prints job counts, queue depths and the status of the services, refreshing them at a fixed interval.')
+        watch_parser.add_argument('--interval',help='The number of seconds between refreshes.',required=False,dest='interval',type=float,default=10)
+        watch_parser.add_argument('--count',help='Stop after this many refreshes. By default, keep going until interrupted with Ctrl-C.',required=False,dest='count',type=int)
+        job_results_parser = subparser.add_parser('job_results', help='Writes the stdout or stderr for a given job id, or for many jobs, to files.')
+        job_results_parser.add_argument('--type',help='Can be stderr, stdout or both', required=True, dest='results_type', choices=['stderr','stdout','both'])
+        job_results_parser.add_argument('--job_id',help='The ID of the job', required=False, dest='job_id')
+        job_results_parser.add_argument('--from_job_id',help='Get the results for all jobs with this job_id or higher.', required=False, dest='from_job_id', type=int)
+        job_results_parser.add_argument('--to_job_id',help='Get the results for all jobs with this job_id or lower.', required=False, dest='to_job_id', type=int)
+        job_results_parser.add_argument('--status',help='Get the results for all jobs with this status (for example: FAILED). Can be given more than once.', required=False, dest='statuses', action='append')
+        job_results_parser.add_argument('--workflow',help='Get the results for all jobs for this workflow.', required=False, dest='workflow')
+        job_results_parser.add_argument('--out_path',help='The path to the directory where you want the results file to be written to.', required=False,dest='out_path', default=os.path.join(launcher.base_dir,'arch3',''))
+        job_results_parser.add_argument('--tar',help='Write all of the results into this compressed tar file (.tar.gz) instead of separate files.', required=False, dest='tar_path')
         return parser
 
     def take_action(self,parsed_args):
         subcmd = vars(parsed_args)['status_subcmd']
-        cmd=''
         sql=''
-        if subcmd == 'queues':
-            # QueueStatus has too much output - Pancancer CLI users will ONLY want to see the queues, so just call rabbitmqadmin directly.
-            cmd = 'rabbitmqadmin list queues vhost name node messages'
-            subprocess.call(cmd.split(' '))
-        elif subcmd == 'job_status':
-            sql='select count(*), status from job group by status;'
-            self._do_sql_status(sql)
-        elif subcmd == 'jobs':
-            sql='select status, job_id, job_uuid, workflow, create_timestamp, update_timestamp from job order by job_id asc;'
+        if subcmd == 'job_status':
+            sql='select count(*) as count, status from job group by status order by status;'
             self._do_sql_status(sql)
         elif subcmd == 'services':
             self._do_service_checks()
+        elif subcmd == 'watch':
+            self._do_watch(vars(parsed_args)['interval'], vars(parsed_args)['count'])
         elif subcmd == 'job_results':
-            job_id = vars(parsed_args)['job_id']
-            if job_id is None or job_id.strip() == '':
-                self.log.info('You must specify a job_id.')
+            args = vars(parsed_args)
+            job_id = args['job_id']
+            conditions = []
+            params = []
+            if job_id is not None and job_id.strip() != '':
+                if not job_id.strip().isdigit():
+                    self.log.info('The job_id must be a number.')
+                    return
+                conditions.append('job_id = %s')
+                params.append(int(job_id))
+            if args['from_job_id'] is not None:
+                conditions.append('job_id >= %s')
+                params.append(args['from_job_id'])
+            if args['to_job_id'] is not None:
+                conditions.append('job_id <= %s')
+                params.append(args['to_job_id'])
+            if args['statuses']:
+                conditions.append('status in ('+', '.join(['%s']*len(args['statuses']))+')')
+                params += args['statuses']
+            if args['workflow'] is not None:
+                conditions.append('workflow = %s')
+                params.append(args['workflow'])
+
+            if conditions == []:
+                self.log.info('You must specify a job_id, or choose jobs with --from_job_id, --to_job_id, --status or --workflow.')
             else:
-                results_type = vars(parsed_args)['results_type']
-                out_path = vars(parsed_args)['out_path']
-                self._get_job_results(job_id, results_type, out_path)
+                results_types = ['stdout','stderr'] if args['results_type'] == 'both' else [args['results_type']]
+                out_path = args['out_path']
+                tar_path = args['tar_path']
+                num_jobs = self._get_job_results(conditions, params, results_types, out_path, tar_path)
+                if num_jobs == 0:
+                    self.log.info('There are no jobs that match.')
+                elif num_jobs == 1 and tar_path is None and job_id is not None and job_id.strip() != '':
+                    for results_type in results_types:
+                        self.log.info('Job results ('+results_type+') have been written to '+os.path.join(out_path,'job_'+job_id.strip()+'.'+results_type))
+                else:
+                    self.log.info('Job results ('+', '.join(results_types)+') for '+str(num_jobs)+' job'+('' if num_jobs==1 else 's')+' have been written to '+(tar_path if tar_path is not None else out_path))
         else:
             self.get_parser('Status').print_help()
+
+###
+
+class JSONLinesFormatter(cliff.formatters.base.ListFormatter):
+    "Writes each row as a JSON object on its own line, as soon as it is read."
+
+    def add_argument_group(self, parser):
+        pass
+
+    def emit_list(self, column_names, data, stdout, parsed_args):
+        for row in data:
+            stdout.write(json.dumps(dict(zip(column_names,row)),default=str)+'\n')
+
+###
+
+class StatusLister(cliff.lister.Lister):
+    "Parent class for status commands that print a list, which can be formatted as a table, csv, json, jsonl, etc..."
+
+    def _load_formatter_plugins(self):
+        plugins = super(StatusLister,self)._load_formatter_plugins()
+        # JSON lines is not one of cliff's own formatters, so it is added here.
+        plugins.extensions.append(stevedore.extension.Extension('jsonl',None,JSONLinesFormatter,JSONLinesFormatter()))
+        return plugins
+
+###
+
+class StatusJobs(StatusLister):
+    "Prints data from the job table (omits standard error and standard out)."
+    log = logging.getLogger(__name__)
+
+    def get_parser(self,prog_name):
+        parser = super(StatusJobs,self).get_parser(prog_name)
+        parser.add_argument('--status',dest='statuses',help='Only show jobs with this status (for example: PENDING, RUNNING, SUCCESS, FAILED). Can be given more than once.',required=False,action='append')
+        parser.add_argument('--workflow',dest='workflow',help='Only show jobs for this workflow.',required=False)
+        parser.add_argument('--since',dest='since',help='Only show jobs that have been updated after this time (for example: "2015-09-02 19:45:26").',required=False)
+        parser.add_argument('--after-job-id',dest='after_job_id',help='Only show jobs with a job_id greater than this. Use the last job_id of the previous page to get the next page.',required=False,type=int)
+        parser.add_argument('--limit',dest='limit',help='The maximum number of jobs to show.',required=False,type=int)
+        parser.add_argument('--offset',dest='offset',help='The number of jobs to skip.',required=False,type=int)
+        return parser
+
+    def take_action(self,parsed_args):
+        args = vars(parsed_args)
+        conditions = []
+        params = []
+        if args['statuses']:
+            conditions.append('status in ('+', '.join(['%s']*len(args['statuses']))+')')
+            params += args['statuses']
+        if args['workflow'] is not None:
+            conditions.append('workflow = %s')
+            params.append(args['workflow'])
+        if args['since'] is not None:
+            conditions.append('update_timestamp > %s')
+            params.append(args['since'])
+        if args['after_job_id'] is not None:
+            conditions.append('job_id > %s')
+            params.append(args['after_job_id'])
+        sql = 'select status, job_id, job_uuid, workflow, create_timestamp, update_timestamp from job'
+        if conditions:
+            sql += ' where '+' and '.join(conditions)
+        sql += ' order by job_id asc'
+        if args['limit'] is not None:
+            sql += ' limit %s'
+            params.append(args['limit'])
+        if args['offset'] is not None:
+            # Connect first, because which database is used (and so its parameter style) is only known once there is a connection.
+            queuedb.QueueDB.get_connection()
+            if args['limit'] is None and queuedb.QueueDB._paramstyle == 'qmark':
+                # SQLite (when it is used in place of PostgreSQL) does not allow an offset without a limit.
+                sql += ' limit -1'
+            sql += ' offset %s'
+            params.append(args['offset'])
+        return queuedb.QueueDB.stream(sql, tuple(params))
+
+###
+
+class StatusQueues(StatusLister):
+    "Prints some basic status information on the RabbitMQ message queues."
+    log = logging.getLogger(__name__)
+
+    def get_parser(self,prog_name):
+        parser = super(StatusQueues,self).get_parser(prog_name)
+        parser.add_argument('--queue',dest='queue_names',help='Only show the queue with this name. Can be given more than once.',required=False,action='append')
+        parser.add_argument('--vhost',dest='vhost',help='Only show the queues in this virtual host.',required=False)
+        return parser
+
+    def take_action(self,parsed_args):
+        queue_names = vars(parsed_args)['queue_names']
+        rabbit_api = rabbitmq.RabbitMQAPI()
+        try:
+            queues = rabbit_api.list_queues(vars(parsed_args)['vhost'])
+        finally:
+            rabbit_api.close()
+        columns = ('vhost','name','node','messages','messages_ready','messages_unacknowledged','consumers','publish_rate','deliver_rate')
+        rows = []
+        for q in queues:
+            if queue_names and q['name'] not in queue_names:
+                continue
+            message_stats = q.get('message_stats',{})
+            rows.append((q.get('vhost'), q['name'], q.get('node'),
+                         q.get('messages',0), q.get('messages_ready',0), q.get('messages_unacknowledged',0), q.get('consumers',0),
+                         message_stats.get('publish_details',{}).get('rate',0.0),
+                         message_stats.get('deliver_get_details',{}).get('rate',0.0)))
+        return columns, rows
@@ -5,6 +5,7 @@ import cliff.command
 import configparser
 import json
 import process_config
+import launcher
 import shutil
 
 class SysConfig(cliff.command.Command):
@@ -148,6 +149,16 @@ class SysConfig(cliff.command.Command):
         aws_secret_key, aws_key = self._ask_for_AWS_Keys(force_config, aws_config_path, aws_key, aws_secret_key, prev_aws_key, prev_aws_secret_key, aws_config)
         return aws_secret_key, aws_key, security_group, spot_price
 
+    def _process_config(self, config_path, force_config):
+        "Render and deploy the config files, unless nothing has changed since the last time. Returns the list of files that were changed."
+        changed_files = process_config.main(config_path, force_config)
+        if changed_files:
+            for changed_file in changed_files:
+                self.log.info('Updated '+changed_file)
+        else:
+            self.log.info('The pancancer config files are already up to date.')
+        return changed_files
+
     def take_action(self, parsed_args):
         self.log.info('Setting up pancancer config files.')
         config_path=vars(parsed_args)['config_path']
@@ -156,18 +167,16 @@ class SysConfig(cliff.command.Command):
         if config_path != None:
             # if the user specifies a path to an existing file, they can use that instead of the interactive process.
             self.log.debug('path to config file: ' + config_path)
-            process_config.main(config_path)
+            self._process_config(config_path, force_config)
         else:
             # if the user did not specify a config, ask them questions and then WRITE/update a config!
-            pancancer_config_path=os.path.expanduser('~/.pancancer/simple_pancancer_config.json')
+            pancancer_config_path=os.path.join(launcher.pancancer_dir,'simple_pancancer_config.json')
             config_data={}
             if os.path.isfile(pancancer_config_path):
                 #Read the pancancer_config.json file if it exists
                 with open(pancancer_config_path,'r') as pancancer_config_file:
                     config_data = json.load(pancancer_config_file)
 
-            pancancer_config={}
-
 
             aws_config_path = os.path.expanduser('~/.aws/config')
             aws_key=''
@@ -186,7 +195,7 @@ class SysConfig(cliff.command.Command):
             # /opt/from_host/config/pancancer.config
             # Actually, fleet name should be coming from process_config.py, not here, since it's passed into the container as an environment variable.
             # If it's NOT there, we should askt he user for these values.
-            bootstrap_config_path='/opt/from_host/config/pancancer.config'
+            bootstrap_config_path=launcher.bootstrap_config_path
             pem_key_path=''
             prev_pem_key_path=''
             key_name=''
@@ -202,7 +211,8 @@ class SysConfig(cliff.command.Command):
                 self.log.debug('bootstrap config file exists at: '+bootstrap_config_path)
                 bootstrap_config_exists = True
                 # load simple config file (it should have been generated by install_bootrap) and get values.
-                H = dict(line.strip().split('=',maxsplit=1) for line in open(bootstrap_config_path))
+                with open(bootstrap_config_path) as bootstrap_config_file:
+                    H = dict(line.strip().split('=',maxsplit=1) for line in bootstrap_config_file)
                 
                 #Now, need to strip the leading and trailing double-quotes
                 for k in H:
@@ -271,9 +281,12 @@ class SysConfig(cliff.command.Command):
 
             # Write the simple JSON config that will be used for the rest of pancancer system.
             # This JSON file will be used as the input to the template file "panancer_config.mustache".
-            pancancer_config = { 'max_fleet_size':fleet_size, 'path_to_key': pem_key_path,
+            # The answers are merged into the existing config, so that the settings that are not asked about here (such as os_env_name,
+            # or the others that QuickStart.md and OpenStack_setup.md say to add to this file) are kept.
+            pancancer_config = dict(config_data)
+            pancancer_config.update({ 'max_fleet_size':fleet_size, 'path_to_key': pem_key_path,
                                 'name_of_key':key_name, 'security_group': security_group, 'cloud_env':cloud_env,
-                                'workflow_listing_url':workflow_listing_url}
+                                'workflow_listing_url':workflow_listing_url})
             if cloud_env == 'AWS':
                 pancancer_config.update( { 'aws_secret_key':aws_secret_key,
                                 'aws_key':aws_key,
@@ -290,8 +303,8 @@ class SysConfig(cliff.command.Command):
                                 'os_zone': os_zone, 'os_network_id': os_network_id } )
 
 
-            if not os.path.exists(os.path.expanduser('~/.pancancer')):
-                os.makedirs(os.path.expanduser('~/.pancancer'))
+            if not os.path.exists(launcher.pancancer_dir):
+                os.makedirs(launcher.pancancer_dir)
 
             with open(pancancer_config_path,'w') as simple_pancancer_config:
                 simple_pancancer_config.write(str(json.dumps(pancancer_config,sort_keys=True, indent=4) ))
@@ -307,4 +320,4 @@ class SysConfig(cliff.command.Command):
                 shutil.copy2(aws_config_path,os.path.expanduser('~/.gnos/config'))
 
             # Now that a config is written, USE IT!!
-            process_config.main(pancancer_config_path)
+            self._process_config(pancancer_config_path, force_config)
@@ -1,10 +1,18 @@
 import logging
 import cliff.command
+import cliff.lister
 import workflowlister
-import shutil
+import mirror
+import inibackups
+import profiler
+import launcher
 import urllib.request
 import os
 import datetime
+import uuid
+import time
+import concurrent.futures
+import csv
 
 class Workflows(cliff.command.Command):
     "This command  can help you configure and select workflows."
@@ -13,69 +21,240 @@ class Workflows(cliff.command.Command):
     def get_parser(self, prog_name):
         parser = super(Workflows, self).get_parser(prog_name)
         # parser.add_mutually_exclusive_group()
-        workflows_subparser = parser.add_subparsers(title='subcommands', help='workflows subcommands: list and config', dest='subparser_name')
-        workflows_subparser.add_parser('list', help='Get a list of workflows')
+        workflows_subparser = parser.add_subparsers(title='subcommands', help='workflows subcommands: config and prefetch (to list the workflows, use: workflows list)', dest='subparser_name')
         config_parser = workflows_subparser.add_parser('config', help='Generate a default config file for a specific workflow')
         config_parser.add_argument('--workflow', dest='workflow_name', help='Name of workflow to configure')
         config_parser.add_argument('--num-INI', dest='num_INI', help='The number of config files to generate.',required=False,default=1)
+        config_parser.add_argument('--manifest', dest='manifest_path', help='A CSV or TSV file with one row per job. The column names are INI keys, and one INI file will be generated for each row with those values filled in. When this is used, --num-INI is ignored.', required=False)
+        config_parser.add_argument('--threads', dest='num_threads', help='The number of threads used to write INI files.', required=False, type=int, default=8)
         config_parser.add_argument('--no-INI-backup', dest='backup_old_INIs', help='Do NOT back up INI files to ~/ini-backups', required=False, action='store_false')
+        config_parser.add_argument('--compress-INI-backups', dest='compress_backups', help='Compress older INI backups into .tar.gz files, in the background. The newest backup is not compressed. Default: the "ini_backups_compress" setting in ~/.pancancer/simple_pancancer_config.json, or false.', required=False, action='store_true', default=None)
+        config_parser.add_argument('--keep-INI-backups', dest='keep_backups', help='Only keep this many INI backups, and remove the oldest ones in the background. Default: the "ini_backups_keep" setting in ~/.pancancer/simple_pancancer_config.json, or keep them all.', required=False, type=int)
+        prefetch_parser = workflows_subparser.add_parser('prefetch', help='Download the workflow bundles (and HTTP container images) of workflows into the local mirror, so that workers can download them from the launcher.')
+        prefetch_parser.add_argument('--workflow', dest='workflow_names', help='The name of a workflow to prefetch. Can be given more than once.', required=False, action='append')
+        prefetch_parser.add_argument('--all', dest='all_workflows', help='Prefetch every available workflow.', required=False, action='store_true')
+        prefetch_parser.add_argument('--threads', dest='num_threads', help='The number of files to download at the same time.', required=False, type=int, default=4)
+        prefetch_parser.add_argument('--mirror-dir', dest='mirror_dir', help='Where to store the downloaded files. Default: ~/.pancancer/mirror', required=False)
         return parser
 
-    def _do_list(self):
-        workflow_list = workflowlister.WorkflowLister.get_workflow_names()
-        self.log.info ('Available workflows are:')
-        self.log.info(workflow_list)
+    def _fetch_templates(self, urls, num_threads):
+        "Download each distinct URL once, using up to num_threads downloads at a time. Returns a dict of URL to content."
+        distinct_urls = list(set(urls))
+        def fetch(url):
+            with profiler.Profiler.phase('template_fetch', url=url), urllib.request.urlopen(url) as response:
+                return response.read()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(num_threads, len(distinct_urls)))) as executor:
+            return dict(zip(distinct_urls, executor.map(fetch, distinct_urls)))
 
-    def _do_config(self, workflow_name, num_INIs, backup_old_INIs):
+    def _write_ini_files(self, ini_dir, ini_files, num_INIs, num_threads):
+        "Write (path, content) pairs (with the paths in ini_dir) to disk using num_threads threads. Progress is logged as files are written, and throughput is reported at the end."
+        def write(path, content):
+            # 'x' mode so that an existing INI is never silently overwritten.
+            with open(path, 'xb') as ini_file:
+                ini_file.write(content)
+            self.log.debug('Generated INI file: '+path)
+
+        start_time = time.time()
+        num_written = 0
+        progress_step = max(1, num_INIs // 10) if num_INIs else 1000
+        next_progress = progress_step
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+            pending = set()
+            for path, content in ini_files:
+                # Keep the number of queued writes bounded so that large batches are never held in memory all at once.
+                if len(pending) >= num_threads * 4:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    num_written += self._check_writes(done)
+                    if num_written >= next_progress:
+                        next_progress += progress_step
+                        self.log.info('Generated '+str(num_written)+(' of '+str(num_INIs) if num_INIs else '')+' INI files')
+                pending.add(executor.submit(write, path, content))
+            num_written += self._check_writes(concurrent.futures.wait(pending).done)
+
+        elapsed = time.time() - start_time
+        profiler.Profiler.record('ini_write', elapsed, files=num_written, threads=num_threads)
+        self.log.info('Generated '+str(num_written)+' INI files in '+ini_dir+' in '+'{:.2f}'.format(elapsed)+' seconds ('+'{:.1f}'.format(num_written / elapsed if elapsed > 0 else num_written)+' files/second)')
+        return num_written
+
+    def _check_writes(self, done):
+        "Re-raise the first error from a set of completed writes and return how many were completed."
+        for future in done:
+            future.result()
+        return len(done)
+
+    def _read_manifest(self, manifest_path):
+        "Yields the rows of a CSV or TSV manifest as dicts, one at a time, so the manifest is never loaded into memory all at once."
+        with open(manifest_path, newline='') as manifest_file:
+            if manifest_path.lower().endswith(('.tsv', '.tab')):
+                dialect = 'excel-tab'
+            else:
+                try:
+                    dialect = csv.Sniffer().sniff(manifest_file.readline(), delimiters=',\t;')
+                except csv.Error:
+                    # A manifest with a single column has no delimiter to find.
+                    dialect = 'excel'
+                manifest_file.seek(0)
+            for row in csv.DictReader(manifest_file, dialect=dialect):
+                yield row
+
+    def _render_manifest(self, template, manifest_path):
+        "Yields one INI (as bytes) for each row of the manifest: each column replaces the value of the INI key with the same name. Columns that are not in the template are added at the end."
+        template_lines = template.decode('utf-8').splitlines()
+        key_lines = {}
+        for i, line in enumerate(template_lines):
+            if '=' in line and not line.lstrip().startswith(('#', ';')):
+                key_lines[line.split('=', 1)[0].strip()] = i
+        unknown_columns_logged = False
+        for row in self._read_manifest(manifest_path):
+            ini_lines = list(template_lines)
+            for k, v in row.items():
+                # Blank cells and short rows keep the default value.
+                if k is None or v is None or v == '':
+                    continue
+                k = k.strip()
+                if k in key_lines:
+                    ini_lines[key_lines[k]] = k + '=' + v
+                else:
+                    if not unknown_columns_logged:
+                        self.log.warning('The manifest column \''+k+'\' is not in the default INI, it will be added to the end of each INI file.')
+                        unknown_columns_logged = True
+                    ini_lines.append(k + '=' + v)
+            yield ('\n'.join(ini_lines) + '\n').encode('utf-8')
+
+    def _backup_INIs(self, ini_dir, compress_backups=None, keep_backups=None):
+        "Move the INIs in ini_dir into a new backup generation in the INI backup directory (launcher.ini_backup_dir), then compress and prune the older generations in the background if asked to."
+        config_data = workflowlister.WorkflowLister._read_config()
+        if compress_backups is None:
+            compress_backups = bool(config_data.get('ini_backups_compress', False))
+        if keep_backups is None and config_data.get('ini_backups_keep') is not None:
+            # The backup that is about to be made is always kept.
+            keep_backups = max(1, int(config_data['ini_backups_keep']))
+        backups = inibackups.INIBackups()
+        with profiler.Profiler.phase('ini_backup'):
+            generation_path = backups.rotate(ini_dir)
+        if generation_path is None:
+            return
+        self.log.info('The INI files that were in '+ini_dir+' have been backed up to '+generation_path)
+        if compress_backups or keep_backups is not None:
+            backups.tidy_in_background(compress_backups, keep_backups)
+
+    def _do_config(self, workflow_name, num_INIs, backup_old_INIs, num_threads=8, manifest_path=None, compress_backups=None, keep_backups=None):
         if workflow_name in workflowlister.WorkflowLister.get_workflow_keys():
-            backup_dir=os.path.expanduser('~/ini-backups')
-            ini_dir=os.path.expanduser('~/ini-dir')
+            ini_dir=launcher.ini_dir
             self.log.debug("backup old INIS: "+str(backup_old_INIs))
             if backup_old_INIs:
-                # do the backup stuff
-                # First, check that there is a backup folder and create it if it does not exist.
-                if os.path.exists(backup_dir)==False:
-                    os.mkdir(backup_dir)
-
-                # Move the files to backup_dir
-                for ini_file in os.listdir(ini_dir):
-                    if ini_file != 'backup':
-                        self.log.info('backing up file: '+ini_file)
-                        shutil.move(ini_dir+'/'+ini_file,backup_dir+'/'+ini_file)
-
-
-            for i in range(0, num_INIs):
-                datestr = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                # INI files will have unique names based on datetime and index in loop
-                ini_file_name='~/ini-dir/' + workflow_name + '_' + datestr + '_' + str(i) + '.ini'
-                ini_file_path = os.path.expanduser(ini_file_name)
-                if 'HelloWorld' not in workflow_name:
-                    workflow_details = workflowlister.WorkflowLister.get_workflow_details(workflow_name)
-                    url = workflow_details['default-ini']
-
-                    with urllib.request.urlopen(url) as response, open(ini_file_path, 'wb') as ini_file:
-                        self.log.info('Generating INI file: '+ini_file_name)
-                        shutil.copyfileobj(response, ini_file)
-                else:
-                    with open(ini_file_path, 'w') as ini_file:
-                        ini_file.write('greeting=Greetings_from_Panancer_CLI')
+                self._backup_INIs(ini_dir, compress_backups, keep_backups)
+
+
+            # Every INI for this workflow starts out the same, so only download the template once.
+            if 'HelloWorld' not in workflow_name:
+                workflow_details = workflowlister.WorkflowLister.get_workflow_details(workflow_name)
+                url = workflow_details['default-ini']
+                self.log.info('Downloading default INI from '+url)
+                template = self._fetch_templates([url], num_threads)[url]
+            else:
+                template = b'greeting=Greetings_from_Panancer_CLI'
+
+            # INI files will have unique names based on the datetime, a random batch ID and index in loop, so batches generated in the same second can't collide.
+            datestr = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            batch_id = uuid.uuid4().hex[:8]
+            if manifest_path is not None:
+                # The number of rows is not known until the whole manifest has been read.
+                self.log.info('Generating INI files from '+manifest_path)
+                ini_files = ((os.path.join(ini_dir, workflow_name + '_' + datestr + '_' + batch_id + '_' + str(i).zfill(6) + '.ini'), content) for i, content in enumerate(self._render_manifest(template, manifest_path)))
+                self._write_ini_files(ini_dir, ini_files, 0, num_threads)
+            else:
+                width = len(str(num_INIs))
+                ini_files = ((os.path.join(ini_dir, workflow_name + '_' + datestr + '_' + batch_id + '_' + str(i).zfill(width) + '.ini'), template) for i in range(0, num_INIs))
+                self._write_ini_files(ini_dir, ini_files, num_INIs, num_threads)
 
-                #self.log.info('generating default INI in /home/ubuntu/ini-dir/' + workflow_name + '.ini for workflow ' + workflow_name)
-                
         else:
             self.log.info ('Sorry, but ' + workflow_name + ' is not a valid workflow name. Please use the command \'workflows list\' to see a list of available workflows.')
 
+    def _prefetch_urls(self, workflow_details):
+        "Returns the (URL, sha256 or None) of everything that can be mirrored for a workflow. s3:// URLs and registry images are downloaded by the workers themselves."
+        urls = []
+        if 'http_workflow' in workflow_details:
+            urls.append((workflow_details['http_workflow']['url'], workflow_details['http_workflow'].get('sha256')))
+        for container in workflow_details.get('http_containers', {}).values():
+            if 'url' in container:
+                urls.append((container['url'], container.get('sha256')))
+        return [(url, sha256) for url, sha256 in urls if url.startswith(('http://', 'https://'))]
+
+    def _do_prefetch(self, workflow_names, num_threads, mirror_dir=None):
+        "Download the files of each workflow into the mirror, num_threads at a time. Returns 1 if any of them could not be downloaded."
+        store = mirror.Mirror(mirror_dir)
+        downloads = {}
+        for workflow_name in workflow_names:
+            if workflow_name not in workflowlister.WorkflowLister.get_workflow_keys():
+                self.log.info('Sorry, but ' + workflow_name + ' is not a valid workflow name. Please use the command \'workflows list\' to see a list of available workflows.')
+                return 1
+            workflow_details = workflowlister.WorkflowLister.get_workflow_details(workflow_name)
+            urls = self._prefetch_urls(workflow_details)
+            if not urls:
+                self.log.info(workflow_name+' has nothing that can be downloaded over HTTP.')
+            for url, sha256 in urls:
+                downloads[url] = sha256
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(num_threads, len(downloads)))) as executor:
+            futures = {executor.submit(store.fetch, url, sha256): url for url, sha256 in downloads.items()}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    # Whatever was downloaded is kept, so running the command again will resume it.
+                    self.log.error('Could not download '+futures[future]+': '+str(e))
+                    failed.append(futures[future])
+        self.log.info('Mirrored '+str(len(downloads)-len(failed))+' of '+str(len(downloads))+' files in '+store.mirror_dir)
+        if failed:
+            return 1
+
     def take_action(self, parsed_args):
         subparser_name = vars(parsed_args)['subparser_name']
         self.log.debug('subparser: %s', subparser_name)
-        if subparser_name == 'list':
-            self._do_list()
-
-        elif subparser_name == 'config':
+        if subparser_name == 'config':
             workflow_name = vars(parsed_args)['workflow_name']
             num_INIs = vars(parsed_args)['num_INI']
             backup_old_INIs = vars(parsed_args)['backup_old_INIs']
             self.log.debug("backup old INIS: "+str(backup_old_INIs))
-            self._do_config(workflow_name,int(num_INIs),backup_old_INIs)
+            num_threads = vars(parsed_args)['num_threads']
+            manifest_path = vars(parsed_args)['manifest_path']
+            if manifest_path is not None and not os.path.isfile(manifest_path):
+                self.log.info('The manifest file '+manifest_path+' does not exist.')
+                return
+            keep_backups = vars(parsed_args)['keep_backups']
+            if keep_backups is not None and keep_backups < 1:
+                self.log.info('--keep-INI-backups must be at least 1.')
+                return
+            self._do_config(workflow_name,int(num_INIs),backup_old_INIs,num_threads,manifest_path,vars(parsed_args)['compress_backups'],keep_backups)
+        elif subparser_name == 'prefetch':
+            workflow_names = vars(parsed_args)['workflow_names'] or []
+            if vars(parsed_args)['all_workflows']:
+                workflow_names = sorted(workflowlister.WorkflowLister.get_workflow_keys())
+            if not workflow_names:
+                self.log.info('Please give the workflows to prefetch with --workflow, or use --all.')
+                return 1
+            return self._do_prefetch(workflow_names, vars(parsed_args)['num_threads'], vars(parsed_args)['mirror_dir'])
         else:
             self.get_parser('Workflows').print_help()
+
+class WorkflowsList(cliff.lister.Lister):
+    "Lists the available workflows, with one row for each cloud environment that a workflow can run in."
+    log = logging.getLogger(__name__)
+    short_columns = ['workflow', 'version', 'cloud', 'env']
+
+    def get_parser(self, prog_name):
+        parser = super(WorkflowsList, self).get_parser(prog_name)
+        parser.add_argument('--cloud', dest='cloud', help='Only show workflows that can run in this cloud.', required=False, choices=['aws','openstack','azure'])
+        parser.add_argument('--env', dest='env', help='Only show workflows that can run in this OpenStack environment (for example: collaboratory).', required=False)
+        parser.add_argument('--workflow', dest='workflow_name', help='Only show this workflow.', required=False)
+        parser.add_argument('--long', dest='long', help='Also show the full name, image, instance type, LVM devices and container images.', required=False, action='store_true')
+        return parser
+
+    def take_action(self, parsed_args):
+        rows = workflowlister.WorkflowLister.find_workflows(workflow=vars(parsed_args)['workflow_name'], cloud=vars(parsed_args)['cloud'], env=vars(parsed_args)['env'])
+        columns = workflowlister.WorkflowLister.catalog_columns
+        if not vars(parsed_args)['long']:
+            indexes = [columns.index(c) for c in WorkflowsList.short_columns]
+            return WorkflowsList.short_columns, [[row[i] for i in indexes] for row in rows]
+        return columns, rows
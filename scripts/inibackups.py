@@ -0,0 +1,120 @@
+import datetime
+import fcntl
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import time
+import launcher
+import atomicfile
+
+class INIBackups:
+    """Backups of the INI directory. Each backup is a generation: a directory in backup_dir that is named after the time it was made
+    (for example: ~/ini-backups/20151104_153012/), or a .tar.gz file of one once it has been compressed."""
+    log = logging.getLogger(__name__)
+    backup_dir = launcher.ini_backup_dir
+    generation_pattern = re.compile(r'^(\d{8}_\d{6}(?:_\d+)?)(\.tar\.gz)?$')
+
+    def __init__(self, backup_dir=None):
+        self.backup_dir = backup_dir or INIBackups.backup_dir
+
+    def rotate(self, ini_dir):
+        """Move everything in ini_dir into a new generation and leave ini_dir empty. This is one rename of the whole directory, however many files are in it.
+        Returns the path of the generation, or None if there was nothing to back up."""
+        if not os.path.isdir(ini_dir) or not os.listdir(ini_dir):
+            return None
+        if not os.path.exists(self.backup_dir):
+            os.makedirs(self.backup_dir)
+        name = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        generation_path = os.path.join(self.backup_dir, name)
+        i = 0
+        # Two backups in the same second get different names, so that neither is overwritten.
+        while os.path.exists(generation_path) or os.path.exists(generation_path+'.tar.gz'):
+            i += 1
+            generation_path = os.path.join(self.backup_dir, name+'_'+str(i))
+        try:
+            if os.path.islink(ini_dir):
+                raise OSError('it is a symbolic link')
+            os.rename(ini_dir, generation_path)
+        except OSError as e:
+            # The INI directory can't be renamed if it is a mount point or on a different filesystem, so move its contents instead.
+            self.log.debug('could not rename '+ini_dir+' ('+str(e)+'), moving its contents instead')
+            os.mkdir(generation_path)
+            for entry in os.listdir(ini_dir):
+                shutil.move(os.path.join(ini_dir, entry), os.path.join(generation_path, entry))
+        else:
+            os.mkdir(ini_dir)
+        return generation_path
+
+    def generations(self):
+        "Returns the (name, path, compressed) of every generation, oldest first. Anything else in backup_dir (such as INIs that older versions backed up) is left alone."
+        if not os.path.isdir(self.backup_dir):
+            return []
+        generations = []
+        for entry in os.listdir(self.backup_dir):
+            match = INIBackups.generation_pattern.match(entry)
+            path = os.path.join(self.backup_dir, entry)
+            if match is None or (match.group(2) is None and not os.path.isdir(path)):
+                continue
+            generations.append((match.group(1), path, match.group(2) is not None))
+        # A name with a suffix (_1, _2...) was made after the one without it in the same second.
+        return sorted(generations, key=lambda g: (g[0][:15], int(g[0][16:] or 0), g[2]))
+
+    def compress(self, keep_uncompressed=1):
+        "Compress every generation except the newest keep_uncompressed ones into a .tar.gz file, and remove its directory."
+        directories = [g for g in self.generations() if not g[2]]
+        for name, path, compressed in directories[:max(0, len(directories)-keep_uncompressed)]:
+            start = time.time()
+            tar_path = os.path.join(self.backup_dir, name+'.tar.gz')
+            with atomicfile.writer(tar_path, 'wb') as out_file, tarfile.open(fileobj=out_file, mode='w:gz') as tar_file:
+                tar_file.add(path, arcname=name)
+            shutil.rmtree(path)
+            self.log.info('Compressed '+path+' into '+tar_path+' in '+'{:.1f}'.format(time.time()-start)+' seconds')
+
+    def prune(self, keep):
+        "Remove all but the newest keep generations."
+        generations = self.generations()
+        for name, path, compressed in generations[:max(0, len(generations)-keep)]:
+            if compressed:
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
+            self.log.info('Removed the INI backup '+path)
+
+    def tidy(self, compress=False, keep=None):
+        "Compress and prune the generations. Only one process does this at a time."
+        if not os.path.exists(self.backup_dir):
+            os.makedirs(self.backup_dir)
+        with open(os.path.join(self.backup_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Pruning first means that nothing is compressed only to be removed.
+            if keep is not None:
+                self.prune(keep)
+            if compress:
+                self.compress()
+
+    def tidy_in_background(self, compress=False, keep=None):
+        """Run tidy() in a new process that carries on after this one has exited, because compressing or removing a large generation takes a while.
+        Its log is written to .tidy.log in backup_dir."""
+        cmd = [sys.executable, os.path.abspath(__file__), self.backup_dir]
+        if compress:
+            cmd.append('--compress')
+        if keep is not None:
+            cmd += ['--keep', str(keep)]
+        self.log.debug(' '.join(cmd))
+        with open(os.path.join(self.backup_dir, '.tidy.log'), 'a') as log_file:
+            # start_new_session=True so that the process is not stopped along with this one (by Ctrl-C, for example).
+            subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, start_new_session=True)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Compress and prune INI backups.')
+    parser.add_argument('backup_dir')
+    parser.add_argument('--compress', action='store_true', help='Compress every generation except the newest one.')
+    parser.add_argument('--keep', type=int, help='Remove all but the newest KEEP generations.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    INIBackups(args.backup_dir).tidy(args.compress, args.keep)
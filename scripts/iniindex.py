@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import urllib.request
+import launcher
+
+class INIIndex:
+    "A persistent index of the INI files that jobs have already been generated for, and of the keys in each workflow's default INI."
+    log = logging.getLogger(__name__)
+    index_path = os.path.join(launcher.pancancer_dir,'ini_index.db')
+    # Seconds to wait for a default INI to download.
+    timeout = 30
+
+    def __init__(self, index_path=None, read_only=False):
+        "With read_only=True, nothing is written to the index (and it is not created if it does not exist)."
+        self.index_path = index_path or INIIndex.index_path
+        self.read_only = read_only
+        if read_only:
+            if os.path.exists(self.index_path):
+                self._connection = sqlite3.connect('file:'+urllib.request.pathname2url(self.index_path)+'?mode=ro', uri=True)
+                return
+            # An empty index, so that lookups work the same way.
+            self._connection = sqlite3.connect(':memory:')
+        else:
+            index_dir = os.path.dirname(self.index_path)
+            if not os.path.exists(index_dir):
+                os.makedirs(index_dir)
+            self._connection = sqlite3.connect(self.index_path)
+        self._connection.execute('create table if not exists submitted_inis (hash text primary key, workflow_name text, file_name text, submitted_at real)')
+        self._connection.execute('create table if not exists default_ini_keys (url text primary key, keys text, fetched_at real)')
+        self._connection.commit()
+
+    @staticmethod
+    def parse_ini(content):
+        "Parses the key=value lines of an INI file (as bytes) into a dict. Raises ValueError if the file is malformed."
+        try:
+            text = content.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise ValueError('not UTF-8 text ('+str(e)+')')
+        ini = {}
+        for line_number, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if line == '' or line.startswith(('#', ';')):
+                continue
+            k, sep, v = line.partition('=')
+            k = k.strip()
+            if not sep or k == '':
+                raise ValueError('line '+str(line_number)+' is not key=value: '+line)
+            if k in ini:
+                raise ValueError('key '+k+' is set more than once (line '+str(line_number)+')')
+            ini[k] = v.strip()
+        if not ini:
+            raise ValueError('there are no keys in the file')
+        return ini
+
+    @staticmethod
+    def canonical_hash(workflow_name, ini, ignore_keys=()):
+        "A hash of the workflow name and the INI's keys and values that does not depend on the order of the lines, whitespace or comments."
+        digest = hashlib.sha256(workflow_name.encode('utf-8'))
+        for k in sorted(ini):
+            if k not in ignore_keys:
+                digest.update(b'\0'+k.encode('utf-8')+b'='+ini[k].encode('utf-8'))
+        return digest.hexdigest()
+
+    def required_keys(self, url):
+        "Returns the set of keys in the default INI at url, downloading it the first time it is needed. Returns None if it could not be downloaded."
+        row = self._connection.execute('select keys from default_ini_keys where url = ?', (url,)).fetchone()
+        if row is not None:
+            return set(json.loads(row[0]))
+        try:
+            with urllib.request.urlopen(url, timeout=INIIndex.timeout) as response:
+                keys = sorted(INIIndex.parse_ini(response.read()))
+        except (OSError, ValueError) as e:
+            self.log.warning('Could not read the default INI from '+url+' ('+str(e)+'), INI files will not be checked for missing keys.')
+            return None
+        if not self.read_only:
+            self._connection.execute('insert or replace into default_ini_keys (url, keys, fetched_at) values (?, ?, ?)', (url, json.dumps(keys), time.time()))
+            self._connection.commit()
+        return set(keys)
+
+    def find_submitted(self, hashes):
+        "Returns the subset of hashes that are already in the index."
+        hashes = list(hashes)
+        found = set()
+        # SQLite limits the number of parameters in one statement.
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i+500]
+            rows = self._connection.execute('select hash from submitted_inis where hash in ('+','.join('?'*len(batch))+')', batch)
+            found.update(row[0] for row in rows)
+        return found
+
+    def add(self, workflow_name, entries):
+        "Record that jobs have been generated for entries, a list of (INI path, hash)."
+        now = time.time()
+        self._connection.executemany('insert or replace into submitted_inis (hash, workflow_name, file_name, submitted_at) values (?, ?, ?, ?)',
+                                     ((ini_hash, workflow_name, os.path.basename(ini_path), now) for ini_path, ini_hash in entries))
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,37 @@
+import os
+
+# Where the launcher's files are, and which programs the commands run. On a launcher, everything is under /home/ubuntu, the daemons'
+# pid and lock files are in /tmp and the programs are on the PATH. These can be changed with environment variables, for example to run
+# the CLI against a simulated launcher (see benchmarks/simulate.py):
+#   PANCANCER_BASE_DIR         instead of /home/ubuntu
+#   PANCANCER_RUN_DIR          instead of /tmp
+#   PANCANCER_HOST_CONFIG_DIR  instead of /opt/from_host/config (where install_bootstrap writes pancancer.config)
+#   PANCANCER_BIN_DIR          run Generator, Coordinator, Provisioner, java and pgrep from this directory, if they are in it
+#   PANCANCER_QUEUE_DB         the path of a SQLite database to use instead of the queue_status PostgreSQL database
+base_dir = os.environ.get('PANCANCER_BASE_DIR','/home/ubuntu')
+run_dir = os.environ.get('PANCANCER_RUN_DIR','/tmp')
+host_config_dir = os.environ.get('PANCANCER_HOST_CONFIG_DIR','/opt/from_host/config')
+bin_dir = os.environ.get('PANCANCER_BIN_DIR')
+queue_db_path = os.environ.get('PANCANCER_QUEUE_DB')
+
+master_config_path = os.path.join(base_dir,'arch3','config','masterConfig.ini')
+youxia_config_path = os.path.join(base_dir,'.youxia','config')
+params_path = os.path.join(base_dir,'params.json')
+ini_dir = os.path.join(base_dir,'ini-dir')
+ini_backup_dir = os.path.join(base_dir,'ini-backups')
+server_tags_path = os.path.join(base_dir,'arch3','server-tags.json')
+# The CLI's own config and caches.
+pancancer_dir = os.path.join(base_dir,'.pancancer')
+bootstrap_config_path = os.path.join(host_config_dir,'pancancer.config')
+
+def command(name):
+    "The program to run for name: the one in PANCANCER_BIN_DIR if there is one, otherwise just name (so that it is found on the PATH)."
+    if bin_dir is not None:
+        path = os.path.join(bin_dir,name)
+        if os.path.isfile(path) and os.access(path,os.X_OK):
+            return path
+    return name
+
+def run_file(service_name, extension):
+    "The path of a service's pid, lock or config digest file (for example: /tmp/arch3_Coordinator.pid)."
+    return os.path.join(run_dir,'arch3_'+service_name+'.'+extension)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import profiler
+import launcher
+import atomicfile
+
+class Mirror:
+    """A local, content-addressed store of downloaded files (such as workflow bundles). Each file is stored as sha256/<digest>/<file name>
+    under mirror_dir, and index.json maps the URL it was downloaded from to its digest."""
+    log = logging.getLogger(__name__)
+    mirror_dir = os.path.join(launcher.pancancer_dir,'mirror')
+    # Seconds to wait for the server to respond.
+    timeout = 60
+    chunk_size = 1024*1024
+
+    def __init__(self, mirror_dir=None):
+        self.mirror_dir = mirror_dir or Mirror.mirror_dir
+        self.index_path = os.path.join(self.mirror_dir, 'index.json')
+        self._lock = threading.Lock()
+
+    def read_index(self):
+        if not os.path.isfile(self.index_path):
+            return {}
+        with open(self.index_path,'r') as index_file:
+            return json.load(index_file)
+
+    def _add_to_index(self, url, entry):
+        # Several downloads can finish at the same time, and each one has to see the others' entries.
+        with self._lock:
+            index = self.read_index()
+            index[url] = entry
+            atomicfile.write(self.index_path, json.dumps(index, sort_keys=True, indent=4))
+
+    def lookup(self, url):
+        "Returns the index entry for url if it has been downloaded and is still in the store, otherwise None."
+        entry = self.read_index().get(url)
+        if entry is None or not os.path.isfile(os.path.join(self.mirror_dir, entry['path'])):
+            return None
+        return entry
+
+    @staticmethod
+    def _file_name(url):
+        return os.path.basename(urllib.parse.urlparse(url).path) or 'download'
+
+    @staticmethod
+    def _expected_md5(etag):
+        "S3 ETags are the MD5 of the object, unless it was a multipart upload (then they contain a '-')."
+        etag = (etag or '').strip('"')
+        if len(etag) == 32 and all(c in '0123456789abcdef' for c in etag.lower()):
+            return etag.lower()
+        return None
+
+    def fetch(self, url, sha256=None):
+        """Download url into the store, unless it is already there. A partial download from an earlier attempt is resumed with a Range request.
+        The download is checked against sha256 if it is given, and against the size and the (S3-style) MD5 ETag that the server sends.
+        Returns the index entry for the file."""
+        entry = self.lookup(url)
+        if entry is not None and (sha256 is None or entry['sha256'] == sha256):
+            self.log.info('Already mirrored: '+url)
+            return entry
+
+        partial_dir = os.path.join(self.mirror_dir, 'partial')
+        if not os.path.exists(partial_dir):
+            os.makedirs(partial_dir, exist_ok=True)
+        partial_path = os.path.join(partial_dir, hashlib.sha1(url.encode('utf-8')).hexdigest()+'.part')
+
+        sha256_digest = hashlib.sha256()
+        md5_digest = hashlib.md5()
+        offset = 0
+        if os.path.isfile(partial_path):
+            # The digests have to include what was already downloaded.
+            with open(partial_path,'rb') as partial_file:
+                for chunk in iter(lambda: partial_file.read(Mirror.chunk_size), b''):
+                    sha256_digest.update(chunk)
+                    md5_digest.update(chunk)
+                    offset += len(chunk)
+
+        request = urllib.request.Request(url)
+        if offset > 0:
+            request.add_header('Range','bytes='+str(offset)+'-')
+        start = time.time()
+        with profiler.Profiler.phase('mirror_fetch', url=url, resumed_at=offset):
+            try:
+                response = urllib.request.urlopen(request, timeout=Mirror.timeout)
+            except urllib.error.HTTPError as e:
+                # 416 means that the partial file already has every byte.
+                if e.code != 416 or offset == 0:
+                    raise
+                response = None
+            if response is not None:
+                with response:
+                    if offset > 0 and response.status != 206:
+                        self.log.info('The server does not support resuming downloads, starting '+url+' again.')
+                        offset = 0
+                        sha256_digest = hashlib.sha256()
+                        md5_digest = hashlib.md5()
+                    elif offset > 0:
+                        self.log.info('Resuming '+url+' at byte '+str(offset))
+                    etag = response.headers.get('ETag')
+                    content_length = response.headers.get('Content-Length')
+                    expected_size = offset + int(content_length) if content_length is not None else None
+                    with open(partial_path,'ab' if offset > 0 else 'wb') as partial_file:
+                        for chunk in iter(lambda: response.read(Mirror.chunk_size), b''):
+                            partial_file.write(chunk)
+                            sha256_digest.update(chunk)
+                            md5_digest.update(chunk)
+                            offset += len(chunk)
+            else:
+                etag = None
+                expected_size = None
+
+        if expected_size is not None and offset < expected_size:
+            # The connection was closed early. The partial file is kept so that the next attempt carries on from where this one stopped.
+            raise RuntimeError('The download of '+url+' stopped after '+str(offset)+' of '+str(expected_size)+' bytes, run the command again to resume it.')
+        # Check the download before it goes into the store. A bad partial file is removed so that the next attempt starts from scratch.
+        errors = []
+        if expected_size is not None and offset != expected_size:
+            errors.append('expected '+str(expected_size)+' bytes, got '+str(offset))
+        if sha256 is not None and sha256_digest.hexdigest() != sha256:
+            errors.append('expected sha256 '+sha256+', got '+sha256_digest.hexdigest())
+        expected_md5 = Mirror._expected_md5(etag)
+        # A resumed download's ETag could be of a different object if it changed in between; the MD5 check catches that too.
+        if expected_md5 is not None and md5_digest.hexdigest() != expected_md5:
+            errors.append('expected MD5 '+expected_md5+' (from the ETag), got '+md5_digest.hexdigest())
+        if errors:
+            os.remove(partial_path)
+            raise RuntimeError('The download of '+url+' was not correct: '+'; '.join(errors))
+
+        digest = sha256_digest.hexdigest()
+        relative_path = os.path.join('sha256', digest, Mirror._file_name(url))
+        store_path = os.path.join(self.mirror_dir, relative_path)
+        os.makedirs(os.path.dirname(store_path), exist_ok=True)
+        os.replace(partial_path, store_path)
+        entry = {'sha256':digest, 'size':offset, 'path':relative_path, 'fetched_at':time.time()}
+        self._add_to_index(url, entry)
+        elapsed = time.time() - start
+        self.log.info('Mirrored '+url+' ('+'{:.1f}'.format(offset/1024/1024)+' MB in '+'{:.1f}'.format(elapsed)+' seconds)')
+        return entry
+
+    def mirror_url(self, url, base_url):
+        "Returns the URL of the mirrored copy of url, if base_url is where mirror_dir is served from and url has been mirrored. Otherwise returns url."
+        entry = self.lookup(url)
+        if entry is None:
+            return url
+        return base_url.rstrip('/')+'/'+urllib.parse.quote(entry['path'])
@@ -4,13 +4,35 @@ import sys
 import logging
 import cliff.app
 import cliff.commandmanager
-from commands.workflows import Workflows
-from commands.sysconfig import SysConfig
-from commands.daemons import Coordinator
-from commands.daemons import Provisioner
-from commands.generator import Generator
-from commands.reports import Reports
-from commands.status import Status
+import importlib
+import time
+import profiler
+
+# The commands, and where to find them. A command's module is only imported when that command is run,
+# so that e.g. "pancancer status services" does not have to import pystache, psutil, etc... for all of the other commands.
+commands = {
+    'workflows': 'commands.workflows:Workflows',
+    'workflows list': 'commands.workflows:WorkflowsList',
+    'generator': 'commands.generator:Generator',
+    'reports': 'commands.reports:Reports',
+    'provisioner': 'commands.daemons:Provisioner',
+    'coordinator': 'commands.daemons:Coordinator',
+    'services': 'commands.daemons:Services',
+    'status': 'commands.status:Status',
+    'status jobs': 'commands.status:StatusJobs',
+    'status queues': 'commands.status:StatusQueues',
+    'sysconfig': 'commands.sysconfig:SysConfig'
+}
+
+class LazyCommand:
+    "Takes the place of a command class in the CommandManager, and only imports the command's module when the command is loaded."
+    def __init__(self, name, import_path):
+        self.name = name
+        self.import_path = import_path
+
+    def load(self):
+        module_name, class_name = self.import_path.split(':')
+        return getattr(importlib.import_module(module_name), class_name)
 
 class PancancerApp(cliff.app.App):
     log = logging.getLogger(__name__)
@@ -22,29 +44,51 @@ class PancancerApp(cliff.app.App):
             version='1.0',
             command_manager=commandMgr,
         )
-        commands = {
-            'workflows': Workflows,
-            'generator': Generator,
-            'reports': Reports,
-            'provisioner': Provisioner,
-            'coordinator': Coordinator,
-            'status': Status,
-            'sysconfig': SysConfig
-        }
         for k, v in commands.items():
-            commandMgr.add_command(k, v)
+            commandMgr.commands[k] = LazyCommand(k, v)
+
 
+    def build_option_parser(self, description, version, argparse_kwargs=None):
+        parser = super(PancancerApp, self).build_option_parser(description, version, argparse_kwargs)
+        listing_group = parser.add_mutually_exclusive_group()
+        listing_group.add_argument('--refresh', dest='refresh_listing', help='Download the workflow listing again, even if the cached copy in ~/.pancancer is still fresh.', required=False, action='store_true')
+        listing_group.add_argument('--offline', dest='offline_listing', help='Only use the cached workflow listing in ~/.pancancer, never contact the workflow listing server.', required=False, action='store_true')
+        parser.add_argument('--profile', dest='profile', help='Write how long each phase of the command took, as JSON lines, to stderr (or to --profile-file).', required=False, action='store_true')
+        parser.add_argument('--profile-file', dest='profile_path', help='Append the --profile timings to this file instead of writing them to stderr. Implies --profile.', required=False, default=None)
+        parser.add_argument('--cprofile', dest='cprofile_path', help='Run the command under cProfile and save the stats to CPROFILE_PATH. They can be read with: python3 -m pstats CPROFILE_PATH', required=False, default=None)
+        return parser
 
     def initialize_app(self, argv):
         self.log.debug('initialize_app')
+        if self.options.refresh_listing or self.options.offline_listing:
+            # Only import workflowlister (and urllib) when it's needed.
+            import workflowlister
+            workflowlister.WorkflowLister.refresh = self.options.refresh_listing
+            workflowlister.WorkflowLister.offline = self.options.offline_listing
+        if self.options.profile or self.options.profile_path is not None:
+            profiler.Profiler.start(self.options.profile_path or '-')
+        self._cprofile = None
+        if self.options.cprofile_path is not None:
+            # Only import cProfile when it's needed.
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
 
     def prepare_to_run_command(self, cmd):
         self.log.debug('prepare_to_run_command %s', cmd.__class__.__name__)
+        profiler.Profiler.set_command(getattr(cmd, 'cmd_name', None) or cmd.__class__.__name__)
+        self._command_start = time.perf_counter()
 
     def clean_up(self, cmd, result, err):
         self.log.debug('clean_up %s', cmd.__class__.__name__)
         if err:
             self.log.debug('got an error: %s', err)
+        # The whole command, from after the options were parsed until now.
+        profiler.Profiler.record('command', time.perf_counter() - self._command_start, result=result if isinstance(result, int) else None, error=type(err).__name__ if err else None)
+        profiler.Profiler.stop()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.options.cprofile_path)
 
 
 def main(argv=sys.argv[1:]):
@@ -2,7 +2,19 @@ import json
 import pystache
 import os
 import sys
-import shutil
+import hashlib
+import profiler
+import launcher
+import atomicfile
+
+# Records what was used for the last render, so that the config files are only regenerated when something has changed.
+render_manifest_path = os.path.join(launcher.pancancer_dir,'render_manifest.json')
+# The files that are rendered from the template and where they are deployed to.
+deployed_files = {'youxia_config':launcher.youxia_config_path,
+                  'masterConfig.ini':launcher.master_config_path,
+                  'params.json':launcher.params_path}
+# Environment variables that are merged into the simple config.
+config_env_vars = ['SENSU_SERVER_IP_ADDRESS', 'FLEET_NAME', 'HOST_ENV']
 
 def makeConfigString(k,v):
     return k+'='+v+'\n'
@@ -53,11 +65,67 @@ def processConsonanceSettings(d):
     return outstr
 
 
+def fileDigest(path):
+    "Returns the sha256 hex digest of a file, or None if the file does not exist."
+    if not os.path.isfile(path):
+        return None
+    with open(path,'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def inputsDigest(config_path, template_path):
+    "Returns a digest of everything that the rendered config depends on: the simple config, the environment and the template."
+    h = hashlib.sha256()
+    for path in (config_path, template_path):
+        with open(path,'rb') as f:
+            h.update(f.read())
+        h.update(b'\0')
+    for k in config_env_vars:
+        h.update((k+'='+os.environ.get(k,'')+'\0').encode('utf-8'))
+    return h.hexdigest()
+
+def readRenderManifest():
+    if os.path.isfile(render_manifest_path):
+        with open(render_manifest_path) as manifest_file:
+            try:
+                return json.load(manifest_file)
+            except ValueError:
+                pass
+    return {}
+
+def writeRenderManifest(manifest):
+    manifest_dir = os.path.dirname(render_manifest_path)
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    atomicfile.write(render_manifest_path, str(json.dumps(manifest,sort_keys=True, indent=4) ))
+
+def isUpToDate(manifest, inputs_digest, rendered_dir):
+    """The config is up to date if the inputs are the same as the last render and the rendered copies in rendered_dir have not changed since then.
+    The deployed files are only checked to see that they still exist, because the generator edits them (the image, instance type and workflows)
+    after they have been deployed, and those edits must not cause everything to be rendered and deployed again."""
+    if manifest.get('inputs') != inputs_digest:
+        return False
+    outputs = manifest.get('outputs',{})
+    for name in ['pancancer_config.json'] + list(deployed_files):
+        if name not in outputs or fileDigest(os.path.join(rendered_dir, name)) != outputs[name]:
+            return False
+    for deployed_path in deployed_files.values():
+        if not os.path.isfile(deployed_path):
+            return False
+    return True
+
+
 #######################
 # Main body of script #
 #######################
 
-def main(config_path):
+def main(config_path, force=False):
+    """Render the pancancer config files from the simple config at config_path and deploy them.
+    Returns the list of files that were changed. If the inputs have not changed since the last render, nothing is done (unless force is True) and the list is empty."""
+    template_path = os.path.dirname(__file__) + '/pancancer_config.mustache'
+    inputs_digest = inputsDigest(config_path, template_path)
+    manifest = readRenderManifest()
+    if not force and isUpToDate(manifest, inputs_digest, os.path.dirname(template_path)):
+        return []
 
     with open(config_path) as simple_config_file:
         simple_config=json.load(simple_config_file)
@@ -80,44 +148,46 @@ def main(config_path):
             simple_config['use_openstack'] = "false"
 
     config_path = os.path.dirname(__file__)
-    with open(config_path +'/pancancer_config.mustache') as mustache_template_file:
+    with open(template_path) as mustache_template_file:
         mustache_template=mustache_template_file.read()
 
-    renderer=pystache.Renderer()
-    parsed=pystache.parse(mustache_template)
-    rendered_str=renderer.render(parsed,(simple_config))
-    data=json.loads(rendered_str)
-
-    # The master config file should be written to ~/.pancancer/pancancer_config.json
-    with open(config_path + '/pancancer_config.json','w') as master_config_file:
-        master_config_file.write(str(json.dumps(data,sort_keys=True, indent=4) ))
-
-    # Youxia config should go to ~/.youxia/config
-    with open(config_path + '/youxia_config','w') as youxia_file:
-        youxia_settings=data['youxia']
-        youxia_str=processYouxiaSettings(youxia_settings)
-        youxia_file.write(youxia_str)
-
-    # params.json should go to ~/params.json
-    with open(config_path + '/params.json','w') as params_json_file:
-        params_settings=data['params']
-        params_str=processParams(params_settings)
-        params_json_file.write(params_str)
-
-    # masterConfig should go to ~/arch3/config/masterConfig.ini
-    with open(config_path + '/masterConfig.ini','w') as consonance_file:
-        consonance_settings=data['consonance']
-        consonance_str=processConsonanceSettings(consonance_settings)
-        consonance_file.write(consonance_str)
+    with profiler.Profiler.phase('config_render'):
+        renderer=pystache.Renderer()
+        parsed=pystache.parse(mustache_template)
+        rendered_str=renderer.render(parsed,(simple_config))
+        data=json.loads(rendered_str)
+
+        outputs={}
+        # The master config file should be written to ~/.pancancer/pancancer_config.json
+        outputs['pancancer_config.json']=str(json.dumps(data,sort_keys=True, indent=4) )
+        # Youxia config should go to ~/.youxia/config
+        outputs['youxia_config']=processYouxiaSettings(data['youxia'])
+        # params.json should go to ~/params.json
+        outputs['params.json']=processParams(data['params'])
+        # masterConfig should go to ~/arch3/config/masterConfig.ini
+        outputs['masterConfig.ini']=processConsonanceSettings(data['consonance'])
+
+    # Only write the files whose content has actually changed.
+    changed_files=[]
+    for name, content in outputs.items():
+        content_digest=hashlib.sha256(content.encode('utf-8')).hexdigest()
+        paths=[config_path + '/' + name]
+        if name in deployed_files:
+            paths.append(deployed_files[name])
+        for path in paths:
+            if fileDigest(path) != content_digest:
+                with profiler.Profiler.phase('config_write', path=path):
+                    atomicfile.write(path, content)
+                changed_files.append(path)
+        manifest.setdefault('outputs',{})[name]=content_digest
 
     #create the server tags, if necessary. The user can change this file later, and we won't touch it (since it already exists).
-    server_tags_path = os.path.expanduser('~/arch3/server-tags.json')
+    server_tags_path = launcher.server_tags_path
     if not os.path.exists(server_tags_path):
         with open(server_tags_path,'w') as server_tags_file:
             server_tags={'KEEP':os.environ['FLEET_NAME']}
             server_tags_file.write(str(json.dumps(server_tags,sort_keys=True, indent=4) ))
 
-    shutil.copy2(config_path + '/youxia_config','/home/ubuntu/.youxia/config')
-    shutil.copy2(config_path + '/masterConfig.ini','/home/ubuntu/arch3/config/masterConfig.ini')
-    shutil.copy2(config_path + '/params.json','/home/ubuntu/params.json')
-
+    manifest['inputs']=inputs_digest
+    writeRenderManifest(manifest)
+    return changed_files
@@ -0,0 +1,60 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+class Profiler:
+    "Records how long each phase of a command takes (downloading the listing, rendering config, restarting daemons, running Java, etc...) and writes the timings as JSON lines."
+    # Set by the global --profile option. When this is False, phases are not timed at all.
+    enabled = False
+    _out = None
+    _command = None
+    # Phases can be timed from several threads at once (e.g. writing INI files).
+    _lock = threading.Lock()
+
+    @staticmethod
+    def start(out_path='-'):
+        "Start recording. Timings are appended to the file at out_path, or written to stderr if out_path is '-'."
+        Profiler._out = sys.stderr if out_path == '-' else open(os.path.expanduser(out_path),'a')
+        Profiler.enabled = True
+
+    @staticmethod
+    def set_command(command_name):
+        Profiler._command = command_name
+
+    @staticmethod
+    def record(phase, seconds, **details):
+        "Write one timing record. details are added to the record, and must be serializable as JSON."
+        if not Profiler.enabled:
+            return
+        record = {'time':round(time.time(),3), 'pid':os.getpid(), 'command':Profiler._command, 'phase':phase, 'seconds':round(seconds,6)}
+        record.update(details)
+        line = json.dumps(record, sort_keys=True)+'\n'
+        with Profiler._lock:
+            Profiler._out.write(line)
+            Profiler._out.flush()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def phase(phase, **details):
+        "Time the body of a with statement as a phase. If it raises an exception, the exception type is recorded as the phase's error."
+        if not Profiler.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            details['error'] = type(e).__name__
+            raise
+        finally:
+            Profiler.record(phase, time.perf_counter() - start, **details)
+
+    @staticmethod
+    def stop():
+        if Profiler._out is not None and Profiler._out is not sys.stderr:
+            Profiler._out.close()
+        Profiler._out = None
+        Profiler.enabled = False
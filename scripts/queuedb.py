@@ -0,0 +1,147 @@
+import configparser
+import logging
+import profiler
+import launcher
+import uuid
+
+def print_table(out, columns, rows):
+    "Prints the results of a query to out as a table, in the same layout as psql."
+    rows = [['' if v is None else str(v) for v in row] for row in rows]
+    widths = [len(c) for c in columns]
+    for row in rows:
+        widths = [max(w, len(v)) for w, v in zip(widths, row)]
+    out.write(' | '.join(c.ljust(w) for c, w in zip(columns, widths)).rstrip()+'\n')
+    out.write('-+-'.join('-'*w for w in widths)+'\n')
+    for row in rows:
+        out.write(' | '.join(v.ljust(w) for v, w in zip(row, widths)).rstrip()+'\n')
+    out.write('('+str(len(rows))+' row'+('' if len(rows)==1 else 's')+')\n')
+
+class QueueDB:
+    "Access to the queue_status database that is used by the Coordinator and Provisioner."
+    log = logging.getLogger(__name__)
+    master_config_path = launcher.master_config_path
+    # One connection is opened per process and reused for every query.
+    _connection = None
+    # The DB-API parameter style of the connection. Queries are written with %s placeholders (psycopg2's style).
+    _paramstyle = 'format'
+    # Use server-side cursors (psycopg2 named cursors) when streaming, so that large results are not loaded into memory all at once.
+    _server_side_cursors = False
+    # The number of streams whose rows have not all been read yet. While there are any, the connection is in a transaction.
+    _open_streams = 0
+
+    @staticmethod
+    def connection_params():
+        "Read the database connection parameters from the [database] section of masterConfig.ini."
+        master_config = configparser.ConfigParser()
+        master_config.optionxform = str
+        master_config.read(QueueDB.master_config_path)
+        db_config = master_config['database'] if master_config.has_section('database') else {}
+        return {'host':db_config.get('postgresHost','127.0.0.1'),
+                'user':db_config.get('postgresUser','queue_user'),
+                'password':db_config.get('postgresPass','queue'),
+                'dbname':db_config.get('postgresDBName','queue_status')}
+
+    @staticmethod
+    def use_connection(connection, paramstyle='format'):
+        "Use an already open DB-API connection (for example, a SQLite database with a job table) instead of connecting to PostgreSQL."
+        QueueDB._connection = connection
+        QueueDB._paramstyle = paramstyle
+        QueueDB._server_side_cursors = False
+        QueueDB._open_streams = 0
+
+    @staticmethod
+    def get_connection():
+        if QueueDB._connection is None and launcher.queue_db_path is not None:
+            # Only import sqlite3 when it's needed.
+            import sqlite3
+            QueueDB.log.debug('using the SQLite database '+launcher.queue_db_path)
+            with profiler.Profiler.phase('db_connect', host=launcher.queue_db_path):
+                QueueDB.use_connection(sqlite3.connect(launcher.queue_db_path), 'qmark')
+        if QueueDB._connection is None:
+            try:
+                import psycopg2
+            except ImportError:
+                raise RuntimeError('The psycopg2 module is needed to connect to the queue_status database. It can be installed with: pip3 install psycopg2')
+            params = QueueDB.connection_params()
+            QueueDB.log.debug('connecting to database '+params['dbname']+' on '+params['host']+' as '+params['user'])
+            with profiler.Profiler.phase('db_connect', host=params['host']):
+                QueueDB._connection = psycopg2.connect(**params)
+            # Nothing here writes to the database, so don't leave transactions open. stream() turns this off while its rows are being read.
+            QueueDB._connection.autocommit = True
+            QueueDB._paramstyle = 'format'
+            QueueDB._server_side_cursors = True
+        return QueueDB._connection
+
+    @staticmethod
+    def _sql(sql):
+        if QueueDB._paramstyle == 'qmark':
+            return sql.replace('%s','?')
+        return sql
+
+    @staticmethod
+    def query(sql, params=()):
+        "Run a query and return a tuple of (column names, rows)."
+        cursor = QueueDB.get_connection().cursor()
+        try:
+            QueueDB.log.debug(sql)
+            with profiler.Profiler.phase('db_query', sql=sql):
+                cursor.execute(QueueDB._sql(sql), params)
+                columns = [d[0] for d in cursor.description]
+                return columns, cursor.fetchall()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def stream(sql, params=(), batch_size=1000):
+        """Run a query and return a tuple of (column names, row iterator). Rows are fetched from the server batch_size at a time as the iterator is read.
+        The iterator should be read to the end so that the cursor is closed."""
+        connection = QueueDB.get_connection()
+        if QueueDB._server_side_cursors:
+            # A named cursor has to be in a transaction. With withhold=True it could be used with autocommit, but then PostgreSQL would
+            # run the whole query before returning the first row, so the stream gets a transaction of its own, which is ended when the
+            # cursor is closed. Streams that are opened while another one is still being read share its transaction.
+            if QueueDB._open_streams == 0:
+                connection.autocommit = False
+            QueueDB._open_streams += 1
+            cursor = connection.cursor(name='pancancer_'+uuid.uuid4().hex)
+            cursor.itersize = batch_size
+        else:
+            cursor = connection.cursor()
+        def close():
+            cursor.close()
+            if QueueDB._server_side_cursors:
+                QueueDB._open_streams -= 1
+                if QueueDB._open_streams == 0:
+                    # Nothing was written, so this only ends the transaction.
+                    connection.commit()
+                    connection.autocommit = True
+        QueueDB.log.debug(sql)
+        try:
+            # Only the query and the first batch are timed; the rest is fetched as the rows are read.
+            with profiler.Profiler.phase('db_query', sql=sql):
+                cursor.execute(QueueDB._sql(sql), params)
+                # A named cursor has no description until the first rows have been fetched.
+                first_batch = cursor.fetchmany(batch_size)
+            columns = [d[0] for d in cursor.description]
+        except:
+            close()
+            raise
+        def rows():
+            try:
+                batch = first_batch
+                while batch:
+                    for row in batch:
+                        yield row
+                    batch = cursor.fetchmany(batch_size)
+            finally:
+                close()
+        return columns, rows()
+
+    @staticmethod
+    def close():
+        if QueueDB._connection is not None:
+            QueueDB._connection.close()
+            QueueDB._connection = None
+            QueueDB._paramstyle = 'format'
+            QueueDB._server_side_cursors = False
+            QueueDB._open_streams = 0
@@ -0,0 +1,65 @@
+import base64
+import configparser
+import http.client
+import json
+import logging
+import profiler
+import launcher
+import urllib.parse
+
+class RabbitMQAPI:
+    "A client for the RabbitMQ management HTTP API that keeps one connection open for all requests."
+    log = logging.getLogger(__name__)
+    master_config_path = launcher.master_config_path
+    default_port = 15672
+
+    def __init__(self, host=None, user=None, password=None, port=None, timeout=10):
+        # Anything that is not given is read from the [rabbit] section of masterConfig.ini.
+        master_config = configparser.ConfigParser()
+        master_config.optionxform = str
+        master_config.read(RabbitMQAPI.master_config_path)
+        rabbit_config = master_config['rabbit'] if master_config.has_section('rabbit') else {}
+        self.host = host or rabbit_config.get('rabbitMQHost','localhost')
+        self.user = user or rabbit_config.get('rabbitMQUser','queue_user')
+        self.password = password or rabbit_config.get('rabbitMQPass','queue')
+        self.port = int(port or rabbit_config.get('rabbitMQManagementPort',RabbitMQAPI.default_port))
+        self.timeout = timeout
+        self._connection = None
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._connection
+
+    def get(self, path):
+        "GET a path from the API (for example: /api/queues) and return the parsed JSON."
+        auth = base64.b64encode((self.user+':'+self.password).encode('utf-8')).decode('ascii')
+        headers = {'Authorization':'Basic '+auth, 'Accept':'application/json', 'Connection':'keep-alive'}
+        # If the server has closed the kept-alive connection, open a new one and try once more.
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                with profiler.Profiler.phase('rabbitmq_api', path=path):
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    body = response.read()
+            except (http.client.HTTPException, ConnectionError) as e:
+                self.close()
+                if attempt == 1:
+                    raise
+                self.log.debug('retrying '+path+' after: '+str(e))
+                continue
+            if response.status != 200:
+                raise RuntimeError('The RabbitMQ management API returned '+str(response.status)+' '+response.reason+' for '+path)
+            return json.loads(body.decode('utf-8'))
+
+    def list_queues(self, vhost=None):
+        "Returns the list of queues (all of them, or the ones in vhost) with their stats."
+        if vhost is None:
+            return self.get('/api/queues')
+        return self.get('/api/queues/'+urllib.parse.quote(vhost, safe=''))
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
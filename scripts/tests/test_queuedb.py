@@ -0,0 +1,75 @@
+"""Tests for QueueDB, against a SQLite database with a job table like the one in queue_status.
+
+    python3 -m unittest discover tests
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import launcher
+import queuedb
+from commands.status import StatusJobs
+
+class QueueDBTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='pancancer_test_')
+        self.db_path = os.path.join(self.tmp_dir, 'queue_status.db')
+        connection = sqlite3.connect(self.db_path)
+        with connection:
+            connection.execute('create table job (job_id integer primary key, status text, job_uuid text, workflow text, create_timestamp text, update_timestamp text)')
+            connection.executemany('insert into job (job_id, status, job_uuid, workflow, create_timestamp, update_timestamp) values (?, ?, ?, ?, ?, ?)',
+                                   [(i, 'SUCCESS' if i % 2 else 'PENDING', 'uuid-'+str(i), 'HelloWorld', '2015-11-04 15:30:00', '2015-11-04 15:30:0'+str(i)) for i in range(1, 8)])
+        connection.close()
+        self.old_queue_db_path = launcher.queue_db_path
+        launcher.queue_db_path = self.db_path
+
+    def tearDown(self):
+        queuedb.QueueDB.close()
+        launcher.queue_db_path = self.old_queue_db_path
+        shutil.rmtree(self.tmp_dir)
+
+    def test_query_rewrites_placeholders(self):
+        columns, rows = queuedb.QueueDB.query('select job_id, status from job where status = %s and job_id > %s order by job_id', ('SUCCESS', 2))
+        self.assertEqual(columns, ['job_id', 'status'])
+        self.assertEqual(rows, [(3, 'SUCCESS'), (5, 'SUCCESS'), (7, 'SUCCESS')])
+        self.assertEqual(queuedb.QueueDB._paramstyle, 'qmark')
+
+    def test_stream_reads_every_batch(self):
+        columns, rows = queuedb.QueueDB.stream('select job_id from job where job_id >= %s order by job_id', (2,), batch_size=2)
+        self.assertEqual(columns, ['job_id'])
+        self.assertEqual([r[0] for r in rows], [2, 3, 4, 5, 6, 7])
+
+    def test_stream_with_no_rows(self):
+        columns, rows = queuedb.QueueDB.stream('select job_id from job where status = %s', ('FAILED',))
+        self.assertEqual(columns, ['job_id'])
+        self.assertEqual(list(rows), [])
+
+    def test_stream_error_is_raised(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            queuedb.QueueDB.stream('select no_such_column from job')
+
+    def _status_jobs(self, *argv):
+        command = StatusJobs(None, None)
+        parsed_args = command.get_parser('pancancer status jobs').parse_args(list(argv))
+        columns, rows = command.take_action(parsed_args)
+        return columns, [r[1] for r in rows]
+
+    def test_status_jobs_offset_without_limit(self):
+        columns, job_ids = self._status_jobs('--offset', '5')
+        self.assertEqual(columns, ['status', 'job_id', 'job_uuid', 'workflow', 'create_timestamp', 'update_timestamp'])
+        self.assertEqual(job_ids, [6, 7])
+
+    def test_status_jobs_offset_and_limit(self):
+        columns, job_ids = self._status_jobs('--limit', '2', '--offset', '1')
+        self.assertEqual(job_ids, [2, 3])
+
+    def test_status_jobs_conditions(self):
+        columns, job_ids = self._status_jobs('--status', 'PENDING', '--after-job-id', '2', '--since', '2015-11-04 15:30:05')
+        self.assertEqual(job_ids, [6])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Tests for RabbitMQAPI, against a stub of the management API on a local port.
+
+    python3 -m unittest discover tests
+"""
+import base64
+import http.server
+import json
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rabbitmq
+
+class StubAPIHandler(http.server.BaseHTTPRequestHandler):
+    "Answers GET /api/queues... with the server's queues, or with the server's status if it is not 200. Every request is recorded."
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        # Read before responding, because the test can change it as soon as it has the response.
+        close_after_response = self.server.close_after_response
+        self.server.requests.append((self.path, self.headers.get('Authorization'), self.client_address))
+        body = json.dumps(self.server.queues).encode('utf-8')
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if close_after_response:
+            # Close the connection without saying so, as a server does when a kept-alive connection times out.
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+class RabbitMQAPITest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubAPIHandler)
+        self.server.requests = []
+        self.server.queues = [{'name':'pancancer_arch_3_orders_5', 'vhost':'/', 'messages':3}]
+        self.server.status = 200
+        self.server.close_after_response = False
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.api = rabbitmq.RabbitMQAPI('127.0.0.1', 'queue_user', 'secret', self.server.server_address[1], timeout=5)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_sends_basic_auth(self):
+        self.assertEqual(self.api.get('/api/queues'), self.server.queues)
+        path, authorization, client_address = self.server.requests[0]
+        self.assertEqual(path, '/api/queues')
+        self.assertEqual(authorization, 'Basic '+base64.b64encode(b'queue_user:secret').decode('ascii'))
+
+    def test_connection_is_kept_alive(self):
+        self.api.get('/api/queues')
+        self.api.get('/api/overview')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0][2], self.server.requests[1][2])
+
+    def test_retry_after_server_closes_connection(self):
+        self.server.close_after_response = True
+        self.api.get('/api/queues')
+        self.server.close_after_response = False
+        with self.assertLogs(rabbitmq.RabbitMQAPI.log, 'DEBUG') as logs:
+            self.assertEqual(self.api.get('/api/queues'), self.server.queues)
+        self.assertIn('retrying /api/queues', logs.output[0])
+        # The second request was made again on a new connection.
+        self.assertNotEqual(self.server.requests[0][2], self.server.requests[-1][2])
+
+    def test_error_status_raises(self):
+        self.server.status = 401
+        with self.assertRaises(RuntimeError) as context:
+            self.api.get('/api/queues')
+        self.assertIn('401', str(context.exception))
+        self.assertIn('/api/queues', str(context.exception))
+
+    def test_list_queues_quotes_vhost(self):
+        self.api.list_queues('/')
+        self.assertEqual(self.server.requests[0][0], '/api/queues/%2F')
+
+if __name__ == '__main__':
+    unittest.main()
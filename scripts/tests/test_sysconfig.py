@@ -0,0 +1,77 @@
+"""Tests for SysConfig's simple config, and that the generator (which runs sysconfig) keeps the settings that sysconfig does not ask about.
+
+    python3 -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import launcher
+import workflowlister
+from commands.generator import Generator
+from commands.sysconfig import SysConfig
+
+class SysConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='pancancer_test_')
+        self.pancancer_dir = os.path.join(self.tmp_dir, '.pancancer')
+        os.makedirs(self.pancancer_dir)
+        self.config_path = os.path.join(self.pancancer_dir, 'simple_pancancer_config.json')
+        bootstrap_config_path = os.path.join(self.tmp_dir, 'pancancer.config')
+        with open(bootstrap_config_path, 'w') as bootstrap_config:
+            bootstrap_config.write('PEM_PATH="/home/ubuntu/.ssh/key.pem"\nKEY_NAME="key"\nCLOUD_ENV="OpenStack"\nFLEET_SIZE="3"\n'
+                                   'WORKFLOW_LISTING_URL="http://example.com/workflowlist.json"\nOS_USERNAME="user:tenant"\nOS_PASSWORD="secret"\n'
+                                   'OS_ENDPOINT="http://example.com:5000/v2.0"\nOS_REGION="RegionOne"\n')
+        self.patches = [unittest.mock.patch.object(launcher, 'pancancer_dir', self.pancancer_dir),
+                        unittest.mock.patch.object(launcher, 'bootstrap_config_path', bootstrap_config_path),
+                        unittest.mock.patch.object(workflowlister.WorkflowLister, 'config_path', self.config_path),
+                        unittest.mock.patch.dict(os.environ, {'HOME':self.tmp_dir}),
+                        # Rendering and deploying the config files is process_config's job, and is not tested here.
+                        unittest.mock.patch.object(SysConfig, '_process_config', return_value=[])]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in reversed(self.patches):
+            patch.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_config(self, config):
+        with open(self.config_path, 'w') as config_file:
+            json.dump(config, config_file)
+
+    def _read_config(self):
+        with open(self.config_path) as config_file:
+            return json.load(config_file)
+
+    def test_answers_are_written(self):
+        command = SysConfig(None, None)
+        command.take_action(command.get_parser('pancancer sysconfig').parse_args([]))
+        config = self._read_config()
+        self.assertEqual(config['cloud_env'], 'OpenStack')
+        self.assertEqual(config['max_fleet_size'], '3')
+        self.assertEqual(config['os_username'], 'user:tenant')
+        self.assertEqual(config['workflow_listing_url'], 'http://example.com/workflowlist.json')
+
+    def test_generator_keeps_other_settings(self):
+        extra_settings = {'os_env_name':['collaboratory', 'ebi'], 'workflow_mirror_url':'http://10.0.0.1:8080/',
+                          'workflow_listing_ttl':3600, 'ini_backups_compress':True, 'ini_backups_keep':5}
+        self._write_config(dict(extra_settings, cloud_env='OpenStack', max_fleet_size='1'))
+        Generator(None, None)._configure_system()
+        config = self._read_config()
+        for key, value in extra_settings.items():
+            self.assertEqual(config[key], value)
+        # Anything that sysconfig does ask about is still updated.
+        self.assertEqual(config['max_fleet_size'], '1')
+        self.assertEqual(config['os_region'], 'RegionOne')
+        # The generator reads the mirror's URL after it has run sysconfig.
+        self.assertEqual(Generator(None, None)._read_simple_config()['workflow_mirror_url'], 'http://10.0.0.1:8080/')
+        self.assertEqual(workflowlister.WorkflowLister._read_config()['workflow_listing_ttl'], 3600)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,33 @@
-import urllib, json
+import urllib.request, urllib.error, json
 import os
+import hashlib
+import time
+import logging
+import profiler
+import launcher
+import atomicfile
+
 class WorkflowLister:
     "Get a listing of workflows from a source of workflow metadata."
+    log = logging.getLogger(__name__)
     _workflows = {}
+    # The URL the in-memory listing came from, and the time it was last known to be fresh.
+    _url = None
+    _fetched_at = 0
+    _digest = None
+    # Set from the global --refresh and --offline options.
+    refresh = False
+    offline = False
+    cache_path = os.path.join(launcher.pancancer_dir,'workflow_listing_cache.json')
+    # The catalog of workflows is built from the listing and saved next to the cache, so it is only rebuilt when the listing changes.
+    catalog_path = os.path.join(launcher.pancancer_dir,'workflow_catalog.json')
+    catalog_columns = ['workflow', 'version', 'cloud', 'env', 'full_name', 'image', 'instance_type', 'lvm_devices', 'containers']
+    _catalog = None
+    config_path = os.path.join(launcher.pancancer_dir,'simple_pancancer_config.json')
+    # Default number of seconds that a cached listing is used without checking the server; can be overridden with "workflow_listing_ttl" in the simple config.
+    default_ttl = 300
+    # Seconds to wait for the listing server before falling back to the cache.
+    timeout = 30
 
     @staticmethod
     def get_workflow_names():
@@ -23,12 +48,168 @@ class WorkflowLister:
         return WorkflowLister._workflows[workflow_name]
 
     @staticmethod
-    def read_workflow_details():
-        pancancer_config_path=os.path.expanduser('~/.pancancer/simple_pancancer_config.json')
+    def _read_config():
         config_data={}
-        if os.path.isfile(pancancer_config_path):
+        if os.path.isfile(WorkflowLister.config_path):
             #Read the pancancer_config.json file if it exists
-            with open(pancancer_config_path,'r') as pancancer_config_file:
+            with open(WorkflowLister.config_path,'r') as pancancer_config_file:
                 config_data = json.load(pancancer_config_file)
-        response = urllib.request.urlopen(config_data['workflow_listing_url'])
-        WorkflowLister._workflows = json.loads(response.read().decode('utf-8'))
+        return config_data
+
+    @staticmethod
+    def _read_cache(url):
+        "Returns the cached listing for url, or None if there is no usable cache."
+        if not os.path.isfile(WorkflowLister.cache_path):
+            return None
+        try:
+            with open(WorkflowLister.cache_path,'r') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            WorkflowLister.log.debug('Ignoring unreadable workflow listing cache: '+str(e))
+            return None
+        if cache.get('url') != url or 'workflows' not in cache:
+            return None
+        return cache
+
+    @staticmethod
+    def _write_cache(cache):
+        "Write the cache atomically, so that concurrent readers never see a partial file."
+        cache_dir = os.path.dirname(WorkflowLister.cache_path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        atomicfile.write(WorkflowLister.cache_path, json.dumps(cache,sort_keys=True, indent=4))
+
+    @staticmethod
+    def _use(url, workflows, fetched_at, digest=None):
+        if WorkflowLister._url != url or WorkflowLister._workflows is not workflows:
+            WorkflowLister._catalog = None
+        WorkflowLister._url = url
+        WorkflowLister._workflows = workflows
+        WorkflowLister._fetched_at = fetched_at
+        WorkflowLister._digest = digest
+
+    @staticmethod
+    def _fetch(url, cache):
+        "Download the listing. If there is a cached copy, ask the server to only send the listing if it has changed."
+        request = urllib.request.Request(url)
+        if cache is not None and not WorkflowLister.refresh:
+            if cache.get('etag'):
+                request.add_header('If-None-Match',cache['etag'])
+            if cache.get('last_modified'):
+                request.add_header('If-Modified-Since',cache['last_modified'])
+        now = time.time()
+        try:
+            with profiler.Profiler.phase('listing_fetch', url=url), urllib.request.urlopen(request, timeout=WorkflowLister.timeout) as response:
+                body = response.read()
+                workflows = json.loads(body.decode('utf-8'))
+                cache = {'url':url, 'workflows':workflows, 'digest':hashlib.sha256(body).hexdigest(),
+                         'etag':response.headers.get('ETag'),
+                         'last_modified':response.headers.get('Last-Modified')}
+                WorkflowLister.log.debug('Downloaded workflow listing from '+url)
+        except urllib.error.HTTPError as e:
+            if e.code != 304 or cache is None:
+                raise
+            WorkflowLister.log.debug('Workflow listing at '+url+' has not changed.')
+        cache['fetched_at'] = now
+        WorkflowLister._write_cache(cache)
+        return cache
+
+    @staticmethod
+    def read_workflow_details():
+        config_data = WorkflowLister._read_config()
+        url = config_data['workflow_listing_url']
+        ttl = int(config_data.get('workflow_listing_ttl',WorkflowLister.default_ttl))
+        now = time.time()
+
+        # Already loaded by this process.
+        if WorkflowLister._url == url and (WorkflowLister.offline or now - WorkflowLister._fetched_at < ttl):
+            return
+
+        cache = WorkflowLister._read_cache(url)
+        if cache is not None and not WorkflowLister.refresh and (WorkflowLister.offline or now - cache.get('fetched_at',0) < ttl):
+            WorkflowLister._use(url, cache['workflows'], cache.get('fetched_at',0), cache.get('digest'))
+            return
+
+        if WorkflowLister.offline:
+            raise RuntimeError('Running offline, but there is no cached workflow listing for '+url+' in '+WorkflowLister.cache_path)
+
+        try:
+            cache = WorkflowLister._fetch(url, cache)
+        except (urllib.error.URLError, OSError) as e:
+            # A slow or unavailable listing server should not stop the CLI from working if we have ever seen a listing.
+            if cache is None:
+                raise
+            WorkflowLister.log.warning('Could not download the workflow listing ('+str(e)+'), using the cached copy from '+time.ctime(cache.get('fetched_at',0)))
+            cache['fetched_at'] = now
+        WorkflowLister._use(url, cache['workflows'], cache['fetched_at'], cache.get('digest'))
+
+    @staticmethod
+    def _build_catalog(workflows):
+        "Flattens the listing into one row per workflow and cloud environment (per OpenStack environment for OpenStack), with indexes of the rows by workflow, cloud and env."
+        rows = []
+        for workflow_name in sorted(workflows):
+            details = workflows[workflow_name]
+            if 'http_workflow' in details:
+                version = details['http_workflow'].get('version')
+            else:
+                version = details.get('s3_workflow', {}).get('version')
+            containers = set()
+            for key in ('containers', 's3_containers', 'http_containers'):
+                for container in details.get(key, {}).values():
+                    containers.add(container.get('image_name') or container.get('name'))
+            containers = ','.join(sorted(c for c in containers if c))
+            # Workflows without any cloud-specific details are still listed, with no cloud.
+            for cloud, cloud_details in sorted(details.get('cloud-specific-details', {'':{}}).items()):
+                envs = sorted(cloud_details.items()) if cloud == 'openstack' else [('', cloud_details)]
+                for env, env_details in envs:
+                    rows.append([workflow_name, version, cloud, env, details.get('full_name'),
+                                 env_details.get('image'), env_details.get('instance-type'), env_details.get('lvm_devices'), containers])
+        catalog = {'rows':rows, 'by_workflow':{}, 'by_cloud':{}, 'by_env':{}}
+        for i, row in enumerate(rows):
+            catalog['by_workflow'].setdefault(row[0], []).append(i)
+            catalog['by_cloud'].setdefault(row[2], []).append(i)
+            if row[3]:
+                catalog['by_env'].setdefault(row[3], []).append(i)
+        return catalog
+
+    @staticmethod
+    def get_catalog():
+        "Returns the catalog of the current listing, loading it from catalog_path if it was saved for the same listing, or building (and saving) it if not."
+        WorkflowLister.read_workflow_details()
+        if WorkflowLister._catalog is not None:
+            return WorkflowLister._catalog
+        source = {'url':WorkflowLister._url, 'digest':WorkflowLister._digest}
+        if WorkflowLister._digest is not None and os.path.isfile(WorkflowLister.catalog_path):
+            try:
+                with open(WorkflowLister.catalog_path,'r') as catalog_file:
+                    catalog = json.load(catalog_file)
+                if catalog.get('source') == source and catalog.get('columns') == WorkflowLister.catalog_columns:
+                    WorkflowLister._catalog = catalog
+                    return catalog
+            except (OSError, ValueError) as e:
+                WorkflowLister.log.debug('Ignoring unreadable workflow catalog: '+str(e))
+        catalog = WorkflowLister._build_catalog(WorkflowLister._workflows)
+        catalog['source'] = source
+        catalog['columns'] = WorkflowLister.catalog_columns
+        # Without a digest there is no way to tell later if the listing has changed, so don't save it.
+        if WorkflowLister._digest is not None:
+            try:
+                atomicfile.write(WorkflowLister.catalog_path, json.dumps(catalog))
+            except OSError as e:
+                WorkflowLister.log.debug('Could not save the workflow catalog: '+str(e))
+        WorkflowLister._catalog = catalog
+        return catalog
+
+    @staticmethod
+    def find_workflows(workflow=None, cloud=None, env=None):
+        "Returns the catalog rows (see catalog_columns) that match all of the given workflow name, cloud and OpenStack env."
+        catalog = WorkflowLister.get_catalog()
+        matches = None
+        for index, key in (('by_workflow', workflow), ('by_cloud', cloud), ('by_env', env)):
+            if key is None:
+                continue
+            found = set(catalog[index].get(key, []))
+            matches = found if matches is None else matches & found
+        if matches is None:
+            return list(catalog['rows'])
+        return [catalog['rows'][i] for i in sorted(matches)]